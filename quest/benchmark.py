@@ -0,0 +1,117 @@
+"""
+Measures the cost of sprites: memory per Chicken, bytes allocated per
+frame of updates and update time per frame, for a crowd of Chickens
+updated one by one. Latencies of saving and loading a game are measured
+too.
+
+    python benchmark.py
+    python benchmark.py --chickens 10000 --frames 60 --saves 10
+
+Memory is traced with tracemalloc. Update time is the best of the repeats,
+measured without tracing.
+"""
+import os
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+
+import argparse
+import gc
+import tempfile
+import time
+import tracemalloc
+
+import constants as c
+import sprites as s
+import tools
+from savegame import SaveFile
+
+def spawn_chickens(n):
+    columns = 100
+    return [s.Chicken((i % columns) * c.TILE_WIDTH,
+                      (i // columns) * c.TILE_WIDTH, c.DOWN)
+            for i in range(n)]
+
+def update(chickens, frames):
+    for frame in range(frames):
+        for chicken in chickens:
+            chicken.update(c.TICK_DT)
+
+def measure_memory(n, frames):
+    """
+    Returns bytes per chicken spawned and bytes allocated (and freed) per
+    frame while updating them.
+    """
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    chickens = spawn_chickens(n)
+    per_chicken = (tracemalloc.get_traced_memory()[0] - before) / n
+
+    transient = 0
+    for frame in range(frames):
+        current = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        update(chickens, 1)
+        transient += tracemalloc.get_traced_memory()[1] - current
+    tracemalloc.stop()
+
+    return per_chicken, transient / frames
+
+def measure_time(n, frames, repeats):
+    """
+    Returns best update time per frame in seconds.
+    """
+    chickens = spawn_chickens(n)
+    best = float('inf')
+    for repeat in range(repeats):
+        start = time.perf_counter()
+        update(chickens, frames)
+        best = min(best, (time.perf_counter() - start) / frames)
+
+    return best
+
+def measure_saves(saves):
+    """
+    Saves a new game saves times and loads it back. Returns the SaveFile,
+    which keeps the latencies of the last save and load.
+    """
+    game_data = tools.create_game_data_dict()
+    game_data['current_map'] = c.TRANQUIL_CABIN
+
+    with tempfile.TemporaryDirectory() as directory:
+        save_file = SaveFile(os.path.join(directory, 'savegame.dat'))
+        for i in range(saves):
+            save_file.save(game_data, (0, 0, c.DOWN))
+            save_file.wait()
+        save_file.load()
+        save_file.shutdown()
+
+    return save_file
+
+def run(n, frames, repeats):
+    # Frames of the chicken sheet are cut once and shared, not per chicken.
+    spawn_chickens(1)
+    per_chicken, transient = measure_memory(n, frames)
+    frame_time = measure_time(n, frames, repeats)
+    return {'chickens': n,
+            'bytes_per_chicken': per_chicken,
+            'transient_bytes_per_frame': transient,
+            'update_ms_per_frame': frame_time * 1000}
+
+def format_report(report):
+    return ('{chickens} chickens: {bytes_per_chicken:.0f} B per chicken, '
+            '{transient_bytes_per_frame:.0f} B allocated per frame, '
+            'update {update_ms_per_frame:.2f} ms per frame').format(**report)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark sprites.')
+    parser.add_argument('--chickens', type=int, default=10000)
+    parser.add_argument('--frames', type=int, default=60)
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--saves', type=int, default=10)
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse_args()
+    print(format_report(run(args.chickens, args.frames, args.repeats)))
+    print(measure_saves(args.saves).report())
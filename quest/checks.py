@@ -0,0 +1,81 @@
+"""
+Regression checks of game logic, run headless.
+
+    python checks.py
+
+Each check plays a short scene and raises AssertionError if the game does
+not behave as expected.
+"""
+import os
+os.environ.setdefault('QUEST_HEADLESS', '1')
+
+import pygame as pg
+
+import constants as c
+import main
+import setup
+import tools
+
+def run_ticks(gm, ticks, keys=None):
+    if keys is None:
+        keys = tools.SyntheticKeys()
+    for tick in range(ticks):
+        gm.update(keys, c.TICK_DT, [])
+
+def enter_map(gm, name):
+    """
+    Moves to map name and waits until it has faded in.
+    """
+    gm.state.next = name
+    gm.state.done = True
+    run_ticks(gm, 1)
+    while gm.state.state != 'normal':
+        run_ticks(gm, 1)
+
+def check_catch_crowd_chicken():
+    """
+    Chickens of sandy cove are updated in a Crowd, outside of any sprite
+    group. Walking into one with chicken catch active catches it.
+    """
+    gm = main.make_game()
+    game_data = gm.state.game_data
+    game_data['active_quests'].add('chicken_catch')
+    enter_map(gm, c.TRANQUIL_CABIN)
+    enter_map(gm, c.SANDY_COVE)
+
+    state = gm.state
+    occupancy = state.occupancy
+    chickens = state.inventory['chickens']
+    assert state.crowd is not None, 'sandy cove has no crowd'
+    assert chickens['catchable'] and chickens['catch']
+
+    # A resting chicken with a free tile on its left for the player.
+    tw = c.TILE_WIDTH
+    for chicken, i in state.crowd.index.items():
+        tile = (chicken.rect.x // tw - 1, chicken.rect.y // tw)
+        if (not state.crowd.moving[i] and not occupancy.is_blocked(tile) and
+            occupancy.occupant(tile) is None):
+            break
+    else:
+        raise AssertionError('no chicken to walk into')
+
+    player = state.player
+    occupancy.remove(player)
+    player.rect.topleft = (tile[0] * tw, tile[1] * tw)
+    occupancy.add(player)
+
+    amount = chickens['amount']
+    run_ticks(gm, 1, tools.SyntheticKeys([pg.K_RIGHT]))
+
+    assert chickens['amount'] == amount + 1, 'chicken was not caught'
+    assert chicken.tiled_id in state.inventory['catched_chickens']
+    assert chicken not in state.crowd.index
+    assert chicken.occupancy is None
+
+CHECKS = (check_catch_crowd_chicken,)
+
+if __name__ == '__main__':
+    for check in CHECKS:
+        check()
+        print(check.__name__, 'ok')
+    setup.MAP_CACHE.shutdown()
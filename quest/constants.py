@@ -1,17 +1,47 @@
 # Constants used throughout the game.
 
+import os
+
+# Game logic without window, graphics or sound (e.g. QUEST_HEADLESS=1).
+HEADLESS = os.environ.get('QUEST_HEADLESS', '') not in ('', '0')
+SFX_LOG_SIZE = 1000 # Sounds remembered when headless
+
 CAPTION = "Quest of Fun Unlimited"
 WINDOW_SIZE = (320, 240)
 DISPLAY_SIZE = (640, 480)
-FPS = 60
+FPS = 60 # Render frame cap, 0 for uncapped
+VSYNC = False # Vsync for 'scaled' present mode
+TICK_RATE = 60 # Simulation ticks per second
+TICK_TIME = 1 / TICK_RATE # Seconds per tick
+TICK_DT = 1000 / TICK_RATE / 32 # Movement dt per tick (ms / 32)
+MAX_TICKS_PER_FRAME = 5 # Ticks run before rendering when behind
+LOAD_BUDGET = 0.008 # Seconds per frame spent loading next state
 TILE_WIDTH = 16
 ANIMATION_SPEED = 16 # For map objects
 SFX_DEFAULT_VOLUME = 0.1
+DIRTY_RECTS = False # Push only changed parts of the window to the display
+PRESENT_MODE = None # 'scale_blit', 'scale', 'scale2x', 'scaled' or None for fastest
+PRESENT_BENCHMARK_FRAMES = 20 # Presents timed per mode when picking the fastest
+# Binary cache of parsed tmx maps, next to the game modules
+TMX_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tmx_cache')
+CHUNK_SIZE = 128 # Size of pre-rendered map chunks in pixels
+MAX_CHUNKS = 32 # Chunks kept per map
+MAP_CACHE_BUDGET = 16 * 1024 * 1024 # Bytes of loaded maps kept in memory
+SPATIAL_BUCKET_SIZE = 64 # Size of spatial hash buckets in pixels
+CROWD_MIN_SIZE = 16 # Chickens and wanderers needed for a batched Crowd
+# Saved game, written with F5 on maps, next to the game modules
+SAVE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'savegame.dat')
 
 WHITE = (255, 255, 255)
 BLACK = (0, 0, 0)
 BROWN = (68, 57, 52)
 
+# Sprite direction and action codes
+UP, DOWN, LEFT, RIGHT = range(4)
+DIRECTIONS = {'up': UP, 'down': DOWN, 'left': LEFT, 'right': RIGHT}
+VECTORS = ((0, -1), (0, 1), (-1, 0), (1, 0)) # Indexed by direction code
+RESTING, MOVING, AUTO_MOVING = range(3)
+
 # Map game states
 SANDY_COVE = 'sandy_cove'
 MYSTERIOUS_CAVE = 'mysterious_cave'
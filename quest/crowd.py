@@ -0,0 +1,201 @@
+try:
+    import numpy
+    # numpy imports random lazily, which would happen while entering the
+    # first map with a crowd.
+    import numpy.random
+except ImportError:
+    numpy = None
+
+import constants as c
+from sprites import Chicken, Wanderer
+
+def make_crowd(sprites, occupancy, min_size=c.CROWD_MIN_SIZE):
+    """
+    Returns a Crowd of the chickens and wanderers in sprites, or None if
+    numpy is not available or there are less than min_size of them.
+    Members are removed from sprites.
+    """
+    members = [sprite for sprite in sprites
+               if isinstance(sprite, (Chicken, Wanderer))]
+    if numpy is None or len(members) < min_size:
+        return None
+
+    sprites.remove(*members)
+    return Crowd(members, occupancy)
+
+
+class Crowd:
+    """
+    Batched update of wandering NPCs. Positions, directions, movement and
+    rest counters of all members are kept in numpy arrays and advanced with
+    array operations every frame, following the rules of Chicken and
+    Wanderer updates. Member sprites are only written to when they start
+    or finish a move (the occupancy grid works on sprite rects) and when
+    they are in view, so sprites outside the view have stale rects and
+    images.
+
+    visible is the list of members to draw after the last update.
+    """
+    def __init__(self, sprites, occupancy, seed=None):
+        self.sprites = list(sprites)
+        self.index = {sprite: i for i, sprite in enumerate(self.sprites)}
+        self.occupancy = occupancy
+        self.rng = numpy.random.default_rng(seed)
+        self.visible = []
+
+        n = len(self.sprites)
+        self.alive = numpy.ones(n, bool)
+        self.x = numpy.array([s.rect.x for s in self.sprites], numpy.int32)
+        self.y = numpy.array([s.rect.y for s in self.sprites], numpy.int32)
+        self.direction = numpy.array(
+            [s.direction for s in self.sprites], numpy.int32)
+        self.moving = numpy.array(
+            [s.action == c.MOVING for s in self.sprites], bool)
+        self.pixels_moved = numpy.array(
+            [s.pixels_moved for s in self.sprites], numpy.int32)
+        self.distance = numpy.array(
+            [s.distance for s in self.sprites], numpy.float64)
+        self.speed = numpy.array([s.speed for s in self.sprites], numpy.float64)
+        self.frame = numpy.zeros(n, numpy.int32)
+
+        # Chickens rest for a while between moves and have a rest animation.
+        # Wanderers try to move every frame they are resting.
+        chickens = [isinstance(s, Chicken) for s in self.sprites]
+        self.needs_rest = numpy.array(chickens, bool)
+        self.move_chance = numpy.where(self.needs_rest, 0.008, 1.0)
+        self.rested = numpy.array(
+            [getattr(s, 'rested', True) for s in self.sprites], bool)
+        self.rest_counter = numpy.array(
+            [getattr(s, 'rest_counter', 0) for s in self.sprites], numpy.int32)
+        self.rest_image = numpy.zeros(n, bool)
+
+        self.vectors = numpy.array(c.VECTORS, numpy.int32)
+
+    def __len__(self):
+        return int(self.alive.sum())
+
+    def remove(self, sprite):
+        """
+        Drops sprite from the crowd and writes its state back to it.
+        """
+        i = self.index.pop(sprite, None)
+        if i is None:
+            return
+        self.sync(i)
+        self.alive[i] = False
+        if sprite in self.visible:
+            self.visible.remove(sprite)
+
+    def update(self, dt, view_rect):
+        tw = c.TILE_WIDTH
+        alive = self.alive
+        moving = self.moving
+        previous_x = self.x.copy()
+        previous_y = self.y.copy()
+
+        # Resting members roll for starting a move. Chickens have to finish
+        # their rest animation first.
+        roll = self.rng.random(len(alive)) < self.move_chance
+        start = alive & ~moving & roll & (self.rested | ~self.needs_rest)
+        self.rested[start] = False
+        starters = numpy.flatnonzero(start)
+        directions = self.rng.integers(0, 4, len(starters))
+        for i, direction in zip(starters.tolist(), directions.tolist()):
+            self.begin_moving(i, direction)
+
+        # Rest animation of resting chickens.
+        resting = alive & ~moving & self.needs_rest
+        counter = self.rest_counter
+        done = resting & (counter > 63)
+        counter[done] = 0
+        self.rested[done] = True
+        self.frame[resting] = counter[resting] // 16
+        self.rest_image[resting] = True
+        counter[resting] += 1
+
+        # Movement. Image is picked before moving, like in Sprite.moving.
+        self.frame[moving] = self.pixels_moved[moving] // (tw // 4)
+        self.distance[moving] += self.speed[moving] * dt
+        step = moving & (self.distance >= 1)
+        pixels = numpy.rint(self.distance[step]).astype(numpy.int32)
+        vectors = self.vectors[self.direction[step]]
+        self.x[step] += vectors[:, 0] * pixels
+        self.y[step] += vectors[:, 1] * pixels
+        self.pixels_moved[step] += pixels
+        self.distance[step] = 0
+
+        arrived = step & (self.pixels_moved >= tw)
+        if arrived.any():
+            self.begin_resting(arrived)
+
+        self.write_visible(view_rect, previous_x, previous_y)
+
+    def begin_moving(self, i, direction):
+        """
+        Turns member i to direction and starts moving if the occupancy grid
+        lets it.
+        """
+        sprite = self.sprites[i]
+        self.direction[i] = direction
+        self.frame[i] = 0
+        self.rest_image[i] = False
+        self.sync(i)
+        if self.occupancy.reserve_move(sprite, c.VECTORS[direction]):
+            self.moving[i] = True
+
+    def begin_resting(self, arrived):
+        tw = c.TILE_WIDTH
+        self.moving[arrived] = False
+        self.distance[arrived] = 0
+        self.pixels_moved[arrived] = 0
+        self.frame[arrived] = 0
+        self.rest_image[arrived] = False
+
+        # Snap to the nearest tile like Sprite.correct_position.
+        for axis in (self.x, self.y):
+            offset = axis[arrived] % tw
+            axis[arrived] += numpy.where(offset <= tw / 2, -offset, tw - offset)
+
+        for i in numpy.flatnonzero(arrived).tolist():
+            self.sync(i)
+            self.occupancy.finish_move(self.sprites[i])
+
+    def sync(self, i):
+        """
+        Writes state of member i to its sprite.
+        """
+        sprite = self.sprites[i]
+        direction = int(self.direction[i])
+        sprite.rect.topleft = (int(self.x[i]), int(self.y[i]))
+        sprite.direction = direction
+        sprite.action = c.MOVING if self.moving[i] else c.RESTING
+        sprite.pixels_moved = int(self.pixels_moved[i])
+        sprite.distance = float(self.distance[i])
+        if self.needs_rest[i]:
+            sprite.rested = bool(self.rested[i])
+            sprite.rest_counter = int(self.rest_counter[i])
+
+        if self.rest_image[i]:
+            sprite.image_list = sprite.rest_animations[direction]
+        else:
+            sprite.image_list = sprite.animations[direction]
+        sprite.image = sprite.image_list[self.frame[i]]
+
+    def write_visible(self, view_rect, previous_x, previous_y):
+        """
+        Syncs members overlapping view_rect and collects them to visible. 
+        Positions before the update are set for interpolation.
+        """
+        tw = c.TILE_WIDTH
+        x, y = self.x, self.y
+        in_view = (self.alive &
+                   (x > view_rect.left - tw) & (x < view_rect.right) &
+                   (y > view_rect.top - tw) & (y < view_rect.bottom))
+
+        visible = []
+        for i in numpy.flatnonzero(in_view).tolist():
+            self.sync(i)
+            sprite = self.sprites[i]
+            sprite.previous_position = (int(previous_x[i]), int(previous_y[i]))
+            visible.append(sprite)
+        self.visible = visible
@@ -7,7 +7,10 @@ import tools
 import states
 import menu
 
-def main():
+def make_game():
+    """
+    Returns GameStatesManager started in the main menu.
+    """
     game_data = tools.create_game_data_dict()
     # Create a dictionary to keep track of game states.
     state_dict = {c.SANDY_COVE: states.MapState(c.SANDY_COVE),
@@ -18,19 +21,60 @@ def main():
     gm = tools.GameStatesManager()
     gm.setup(state_dict, c.MAIN_MENU)
     gm.state.start_up(game_data)
+    return gm
+
+def run_headless(ticks, script=None):
+    """
+    Runs game logic for ticks as fast as possible without drawing. 
+    QUEST_HEADLESS has to be set before setup is imported.
+    
+    script(tick, gm) returns keys (e.g. tools.SyntheticKeys) and a list 
+    of events for each tick. Without script, no input is given.
+    Returns the GameStatesManager.
+    """
+    gm = make_game()
+    no_keys = tools.SyntheticKeys()
+    
+    for tick in range(ticks):
+        if script is None:
+            keys, events = no_keys, []
+        else:
+            keys, events = script(tick, gm)
+        gm.update(keys, c.TICK_DT, events)
+    
+    return gm
+
+def main():
+    gm = make_game()
     
     clock = pg.time.Clock()
+    accumulator = 0.0
+    events = []
     
     while True:
-        dt = clock.tick(c.FPS) / 32
-        events = pg.event.get()
-        for event in events:
+        accumulator += clock.tick(c.FPS) / 1000
+        new_events = pg.event.get()
+        for event in new_events:
             if (event.type == pg.QUIT or 
                 event.type == pg.KEYDOWN and event.key == pg.K_ESCAPE):
                 return
+        # Events wait for the next tick if none is run this frame.
+        events.extend(new_events)
         keys = pg.key.get_pressed()
-        # Update game state through GameStateManager.
-        gm.update(setup.window, keys, dt, events)
+        
+        # Update game state through GameStateManager in fixed ticks.
+        ticks = 0
+        while accumulator >= c.TICK_TIME:
+            gm.update(keys, c.TICK_DT, events)
+            events = []
+            accumulator -= c.TICK_TIME
+            ticks += 1
+            if ticks == c.MAX_TICKS_PER_FRAME:
+                # Too far behind, drop the rest instead of catching up.
+                accumulator = 0.0
+                break
+        
+        gm.draw(setup.window, accumulator / c.TICK_TIME)
         
         # Show fps in caption.
         fps = clock.get_fps()
@@ -40,5 +84,7 @@ def main():
         
 if __name__ == '__main__':
     main()
+    setup.MAP_CACHE.shutdown()
+    setup.SAVES.shutdown()
     pg.quit()
     sys.exit()
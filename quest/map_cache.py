@@ -0,0 +1,193 @@
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import constants as c
+from tmx_renderer import Renderer
+
+class MapCache:
+    """
+    Process wide cache of loaded maps. Keeps the Renderer of each map (with 
+    its parsed TiledMap and rendered chunks) so that revisiting a map does 
+    not load it again. Least recently used maps are dropped when the memory 
+    held goes over budget.
+    
+    Maps can also be prefetched: they are parsed on a background thread 
+    and picked up by get when the player arrives. Tile images are set up 
+    and chunks rendered on the main thread only (SDL is not thread safe), 
+    by the time-sliced start up steps of the entered state.
+    """
+    def __init__(self, tmx_files, budget=c.MAP_CACHE_BUDGET):
+        self.tmx_files = tmx_files
+        self.budget = budget
+        self.renderers = OrderedDict()
+        self.current = None
+        self.lock = threading.Lock()
+        
+        self.executor = None
+        self.pending = {} # Map name: future of prefetch in progress.
+        self.prefetched = set() # Prefetched maps not used yet.
+        self.missed = set() # Maps parsed in the background on a miss.
+        
+        self.hits = 0
+        self.misses = 0
+        self.prefetch_wins = 0
+        self.prefetch_wasted = 0
+    
+    def get(self, name):
+        """
+        Returns Renderer for map name. Waits for a prefetch in progress and 
+        loads map synchronously on a miss. Shared tilesets released when 
+        the map was left are taken back.
+        """
+        future = self.pending.pop(name, None)
+        if future is not None:
+            # Wait for the prefetch in progress. If it failed, map is loaded 
+            # synchronously below.
+            future.exception()
+        
+        with self.lock:
+            renderer = self.renderers.get(name)
+            if renderer is not None:
+                self.renderers.move_to_end(name)
+                if name in self.prefetched:
+                    self.prefetched.discard(name)
+                    self.prefetch_wins += 1
+                elif name in self.missed:
+                    self.missed.discard(name)
+                    self.misses += 1
+                else:
+                    self.hits += 1
+        
+        if renderer is None:
+            self.misses += 1
+            renderer = Renderer(self.tmx_files[name])
+            with self.lock:
+                self.renderers[name] = renderer
+        
+        renderer.load_images()
+        renderer.acquire()
+        self.current = name
+        self.evict()
+        return renderer
+    
+    def get_steps(self, name):
+        """
+        Generator version of get for time-sliced start ups. A map that is 
+        not cached is parsed on the background thread, yielding while it 
+        is not ready, instead of blocking the frame. Returns the Renderer.
+        """
+        future = self.pending.get(name)
+        if future is None and name not in self.renderers:
+            future = self.submit(name, prefetch=False)
+        
+        while future is not None and not future.done():
+            # Short waits give the parsing thread the GIL.
+            wait([future], timeout=0.001)
+            yield
+        
+        return self.get(name)
+    
+    def preload(self, names):
+        """
+        Loads maps synchronously without making them current, e.g. so that 
+        forked processes share the parsed maps.
+        """
+        for name in names:
+            if name not in self.renderers:
+                renderer = Renderer(self.tmx_files[name])
+                with self.lock:
+                    self.renderers[name] = renderer
+        self.evict()
+    
+    def prefetch(self, names):
+        """
+        Starts parsing maps that are not cached yet on a background thread.
+        """
+        self.pending = {name: future for name, future in self.pending.items() 
+                        if not future.done()}
+        
+        for name in dict.fromkeys(names):
+            if (name in self.pending or name in self.renderers or 
+                name not in self.tmx_files):
+                continue
+            self.submit(name)
+    
+    def submit(self, name, prefetch=True):
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix='map_prefetch')
+        future = self.executor.submit(self.load_in_background, name, prefetch)
+        self.pending[name] = future
+        return future
+    
+    def load_in_background(self, name, prefetch=True):
+        renderer = Renderer(self.tmx_files[name], load_images=False)
+        
+        with self.lock:
+            self.renderers[name] = renderer
+            if prefetch:
+                self.prefetched.add(name)
+            else:
+                self.missed.add(name)
+    
+    def evict(self):
+        """
+        Drops least recently used maps until memory held is within budget. 
+        The map in use is always kept.
+        """
+        with self.lock:
+            while self.bytes_held() > self.budget:
+                name = next((name for name in self.renderers 
+                             if name != self.current), None)
+                if name is None:
+                    break
+                renderer = self.renderers.pop(name)
+                renderer.release()
+                if name in self.prefetched:
+                    self.prefetched.discard(name)
+                    self.prefetch_wasted += 1
+                self.missed.discard(name)
+    
+    def clear(self):
+        with self.lock:
+            for renderer in self.renderers.values():
+                renderer.release()
+            self.prefetch_wasted += len(self.prefetched)
+            self.prefetched.clear()
+            self.missed.clear()
+            self.renderers.clear()
+    
+    def shutdown(self):
+        """
+        Stops background loading. Waits for the prefetch in progress.
+        """
+        if self.executor is not None:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+            self.executor = None
+        self.pending.clear()
+    
+    def bytes_held(self):
+        return sum(renderer.memory_usage() 
+                   for renderer in list(self.renderers.values()))
+    
+    def stats(self):
+        """
+        Returns dictionary of cache hits, misses, prefetch wins and wasted 
+        prefetches (evicted before use), bytes held and maps held.
+        """
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'prefetch_wins': self.prefetch_wins,
+                'prefetch_wasted': self.prefetch_wasted,
+                'bytes': self.bytes_held(),
+                'maps': len(self.renderers)
+        }
+    
+    def report(self):
+        stats = self.stats()
+        return (f"maps: {stats['maps']} hits: {stats['hits']} "
+                f"misses: {stats['misses']} "
+                f"prefetched: {stats['prefetch_wins']} "
+                f"wasted: {stats['prefetch_wasted']} "
+                f"held: {stats['bytes'] / 1024:.0f} kB")
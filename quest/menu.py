@@ -1,10 +1,9 @@
 import pygame as pg
 import sys
-from tmx_renderer import Renderer
 
 from states import MapState
-from setup import update_display, play_sfx, TMX, MUSIC, FONTS
-from tools import State
+from setup import update_display, play_sfx, TMX, MUSIC, FONTS, MAP_CACHE, SAVES
+from tools import State, DirtyTracker
 
 from sprites import Sprite, Chicken
 import constants as c
@@ -19,17 +18,23 @@ class MainMenu(MapState):
         self.music = MUSIC[self.music_title]
         self.volume = 1.0
 
-    def start_up(self, game_data):
+    def start_up_steps(self, game_data):
         self.game_data = game_data
         self.music, self.volume = self.set_music()
 
-        self.tmx_renderer = Renderer(self.tmx_map)
-        self.map_image = self.tmx_renderer.render_map()
-        self.map_rect = self.map_image.get_rect()
+        self.tmx_renderer = yield from MAP_CACHE.get_steps(self.name)
+        self.map_rect = pg.Rect(0, 0, self.tmx_renderer.map_width, 
+                                self.tmx_renderer.map_height)
 
         self.selector = self.make_selector()
         self.blockers = self.make_blockers()
         self.menu_sprites = self.make_menu_sprites()
+        self.occupancy = self.make_occupancy_grid(
+            [self.selector, *self.menu_sprites])
+        self.dirty = DirtyTracker()
+        self.message = None # Shown under the menu, e.g. why loading failed.
+        MAP_CACHE.prefetch([c.TRANQUIL_CABIN])
+        yield
 
     def make_selector(self):
         layer = self.tmx_renderer.get_layer('start_points')
@@ -45,40 +50,63 @@ class MainMenu(MapState):
 
         for obj in layer:
             if obj.name == 'chicken':
-                chicken = Chicken(obj.x, obj.y, 'down', color='red')
+                chicken = Chicken(obj.x, obj.y, c.DOWN, color='red')
                 menu_sprites.add(chicken)
         
         return menu_sprites
 
     def clean_up(self):
+        self.tmx_renderer.release()
         return State.clean_up(self)
     
-    def update(self, window, keys, dt, events):
+    def update(self, keys, dt, events):
         self.selector.update(events, dt)
         self.menu_sprites.update(dt)
-        for blocker in self.blockers:
-            if self.selector.rect.colliderect(blocker):
-                self.selector.begin_resting()
-            for sprite in self.menu_sprites:
-                if sprite.rect.colliderect(blocker):
-                    sprite.begin_resting()
-        
-        self.draw(window)
-        update_display(window)
+        self.occupancy.bumps.clear()
 
         if self.selector.start_game:
             self.next = c.TRANQUIL_CABIN
             self.done = True
+        
+        if self.selector.load_game:
+            self.selector.load_game = False
+            self.load_game()
+    
+    def load_game(self):
+        """
+        Continues saved game on its map. If there is no valid save, the 
+        player is told so under the menu.
+        """
+        game_data = SAVES.load()
+        if game_data is None:
+            if SAVES.exists():
+                self.message = 'Saved game can not be loaded'
+            else:
+                self.message = 'No saved game'
+            self.dirty.invalidate()
+            return
+        
+        self.game_data = game_data
+        self.next = game_data['current_map']
+        self.done = True
     
-    def draw(self, window):
+    def draw(self, window, alpha):
+        placed = [(sprite, sprite.interpolate(alpha)) 
+                  for sprite in [self.selector, *self.menu_sprites]]
+        
+        rects = None
+        if c.DIRTY_RECTS:
+            rects = self.find_dirty_rects(placed, (0, 0))
+            if not rects:
+                return
+        
         window.fill(c.BLACK)
-        window.blit(self.selector.image, self.selector.rect)
-
-        for sprite in self.menu_sprites:
-            window.blit(sprite.image, sprite.rect)
+        for sprite, position in placed:
+            window.blit(sprite.image, position)
         
         self.draw_title(window)
         self.draw_menu(window)
+        update_display(window, rects)
 
     def draw_title(self, window):
         font = pg.font.Font(FONTS['SuperLegendBoy'], 16)
@@ -92,6 +120,8 @@ class MainMenu(MapState):
         self.draw_menu_line(window, font, 0, 'Start a new game !')
         self.draw_menu_line(window, font, 1, 'Load game')
         self.draw_menu_line(window, font, 2, 'Exit')
+        if self.message is not None:
+            self.draw_menu_line(window, font, 4, self.message)
 
     def draw_menu_line(self, window, font, line_number, line_text):
         line = font.render(line_text, True, c.WHITE)
@@ -108,6 +138,7 @@ class Selector(Sprite):
         super().__init__('selector', x, y)
         self.speed = 2
         self.start_game = False
+        self.load_game = False
     
     def update(self, events, dt):
         self.check_for_input(events)
@@ -117,16 +148,16 @@ class Selector(Sprite):
         for event in events:
             if event.type == pg.KEYDOWN:
                 if event.key == pg.K_DOWN:
-                    self.begin_moving('down')
+                    self.begin_moving(c.DOWN)
                     play_sfx('select', 0.5)
                 elif event.key == pg.K_UP:
-                    self.begin_moving('up')
+                    self.begin_moving(c.UP)
                     play_sfx('select', 0.5)
                 elif event.key == pg.K_RETURN or event.key == pg.K_SPACE:
                     if self.rect.y == 96:
                         self.start_game = True
                     if self.rect.y == 112:
-                        pass
+                        self.load_game = True
                     if self.rect.y == 128:
                         pg.quit()
                         sys.exit()
@@ -17,13 +17,26 @@ GNU Lesser General Public License for more details.
 You should have received a copy of the GNU Lesser General Public
 License along with pytmx.  If not, see <http://www.gnu.org/licenses/>.
 """
+import array
+import hashlib
 import logging
 import os
+import pickle
+import re
+import struct
+import sys
+import threading
+import weakref
 from collections import defaultdict, namedtuple
 from itertools import chain, product
 from operator import attrgetter
 from xml.etree import ElementTree
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 __all__ = (
     'TiledElement',
     'TiledMap',
@@ -33,6 +46,9 @@ __all__ = (
     'TiledObjectGroup',
     'TiledImageLayer',
     'TileFlags',
+    'TilesetRegistry',
+    'LazyImageTable',
+    'tileset_registry',
     'convert_to_bool',
     'parse_properties')
 
@@ -59,6 +75,17 @@ flag_names = (
 TileFlags = namedtuple('TileFlags', flag_names)
 AnimationFrame = namedtuple('AnimationFrame', ['gid', 'duration'])
 
+# binary map cache: magic, format version, source digest, metadata length,
+# layer data length.  bump CACHE_VERSION whenever the cached layout changes.
+CACHE_MAGIC = b'PTMX'
+CACHE_VERSION = 3
+CACHE_EXTENSION = '.tmxc'
+cache_header = struct.Struct('<4sH20sII')
+# array typecode of an unsigned 32-bit int for raw layer data
+uint32_typecode = 'I' if array.array('I').itemsize == 4 else 'L'
+
+tileset_source_pattern = re.compile(rb'<tileset[^>]*\ssource="([^"]+)"')
+
 
 def default_image_loader(filename, flags, **kwargs):
     """ This default image loader just returns filename, rect, and any flags
@@ -87,6 +114,65 @@ def decode_gid(raw_gid):
     return gid, flags
 
 
+def parse_csv_gids(text):
+    """ Convert the text of a csv encoded layer to a buffer of raw gids
+
+    :param text: comma separated gids, whitespace is ignored
+    :return: array of unsigned 32-bit raw gids
+    """
+    if numpy is not None:
+        values = numpy.fromstring(text, dtype=numpy.uint32, sep=',')
+        return array.array(uint32_typecode, values.tobytes())
+    return array.array(uint32_typecode, map(int, text.split(',')))
+
+
+def parse_binary_gids(data):
+    """ Convert decoded (and decompressed) layer bytes to a buffer of raw gids
+
+    :param data: bytes of little-endian unsigned 32-bit gids
+    :return: array of unsigned 32-bit raw gids
+    """
+    raw_gids = array.array(uint32_typecode)
+    raw_gids.frombytes(data)
+    if sys.byteorder == 'big':
+        raw_gids.byteswap()
+    return raw_gids
+
+
+def decode_layer_gids(raw_gids, register_gid):
+    """ Decode and register a whole layer of raw gids in bulk
+
+    Only the distinct raw gids (gid and flip flags) are decoded and
+    registered, in order of first appearance, so the gids assigned are the
+    same as when registering the tiles one by one.  The layer is then
+    remapped with a single lookup.
+
+    :param raw_gids: array of unsigned 32-bit raw gids
+    :param register_gid: TiledMap.register_gid
+    :return: array of 16-bit pytmx gids
+    """
+    if numpy is not None:
+        values = numpy.frombuffer(raw_gids, dtype=numpy.uint32)
+        unique, first, inverse = numpy.unique(
+            values, return_index=True, return_inverse=True)
+        order = numpy.argsort(first, kind='stable')
+        tiled_gids = unique & ~numpy.uint32(
+            GID_TRANS_FLIPX | GID_TRANS_FLIPY | GID_TRANS_ROT)
+        flip_x = (unique & numpy.uint32(GID_TRANS_FLIPX)) != 0
+        flip_y = (unique & numpy.uint32(GID_TRANS_FLIPY)) != 0
+        rotate = (unique & numpy.uint32(GID_TRANS_ROT)) != 0
+
+        lookup = numpy.zeros(len(unique), dtype=numpy.uint16)
+        for i in order.tolist():
+            flags = TileFlags(bool(flip_x[i]), bool(flip_y[i]), bool(rotate[i]))
+            lookup[i] = register_gid(int(tiled_gids[i]), flags)
+        return array.array('H', lookup[inverse.ravel()].tobytes())
+
+    lookup = {raw_gid: register_gid(*decode_gid(raw_gid))
+              for raw_gid in dict.fromkeys(raw_gids)}
+    return array.array('H', map(lookup.__getitem__, raw_gids))
+
+
 def convert_to_bool(value):
     """ Convert a few common variations of "true" and "false" to boolean
 
@@ -197,6 +283,147 @@ def parse_properties(node):
     return d
 
 
+class SharedTileset(object):
+    """ External tileset data shared by every map that references it
+
+    Holds the parsed tsx root and the tile images loaded from it, keyed by
+    (image loader, tile rect, flags).
+    """
+
+    def __init__(self, path, mtime):
+        self.path = path
+        self.mtime = mtime
+        self.refs = 0
+        self.images = dict()
+        self._root = None
+
+    @property
+    def root(self):
+        """ ElementTree root of the tsx file, parsed on first use
+        """
+        if self._root is None:
+            try:
+                self._root = ElementTree.parse(self.path).getroot()
+            except IOError as io:
+                msg = "Error loading external tileset: {0}"
+                logger.error(msg.format(self.path))
+                raise Exception(msg.format(self.path)) from io
+        return self._root
+
+
+class LazyImageTable(list):
+    """ List of tile images that loads deferred images on first access
+
+    TiledMap.images is one of these; indexing it with a gid returns the
+    image, loading it first if needed.  Iterating over it loads everything.
+    """
+
+    def __init__(self, size=0):
+        list.__init__(self, [None] * size)
+        self.pending = dict()
+
+    def defer(self, index, load, *args):
+        """ Register a function that will load the image at index
+
+        :param index: gid of the image
+        :param load: function returning the image
+        :param args: arguments for load
+        """
+        list.__setitem__(self, index, None)
+        self.pending[index] = (load, args)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+
+        image = list.__getitem__(self, index)
+        if image is None and self.pending:
+            if index < 0:
+                index += len(self)
+            job = self.pending.pop(index, None)
+            if job is not None:
+                load, args = job
+                image = load(*args)
+                list.__setitem__(self, index, image)
+        return image
+
+    def __setitem__(self, index, image):
+        if not isinstance(index, slice):
+            self.pending.pop(index, None)
+        list.__setitem__(self, index, image)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def loaded(self):
+        """ Return list of the images loaded so far, without loading any
+
+        :rtype: list
+        """
+        return [image for image in list.__iter__(self) if image is not None]
+
+
+class TilesetRegistry(object):
+    """ Process wide registry of external tilesets
+
+    Entries are keyed by real path and reused while the file's mtime is
+    unchanged.  Every TiledMap acquires the tilesets it references and
+    releases them when it is done, or at the latest when it is garbage
+    collected; an entry is dropped once it has no refs.  Maps may be loaded
+    from several threads.
+    """
+
+    def __init__(self):
+        self.entries = dict()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def acquire(self, path):
+        """ Return the shared tileset for path and add a reference to it
+
+        :param path: path of the tsx file
+        :rtype: SharedTileset
+        """
+        path = os.path.realpath(path)
+        mtime = os.path.getmtime(path)
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry is None or entry.mtime != mtime:
+                entry = SharedTileset(path, mtime)
+                self.entries[path] = entry
+            entry.refs += 1
+        return entry
+
+    def release(self, entry):
+        """ Remove a reference, dropping the entry when none are left
+
+        :param entry: SharedTileset returned by acquire
+        """
+        with self.lock:
+            entry.refs -= 1
+            if entry.refs <= 0 and self.entries.get(entry.path) is entry:
+                del self.entries[entry.path]
+
+    def release_all(self, shared_tilesets):
+        """ Release every entry of a map's shared tilesets and clear them
+
+        :param shared_tilesets: dict of tsx path -> SharedTileset
+        """
+        for entry in shared_tilesets.values():
+            self.release(entry)
+        shared_tilesets.clear()
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+tileset_registry = TilesetRegistry()
+
+
 class TiledElement(object):
     """ Base class for all pytmx types
     """
@@ -289,7 +516,13 @@ class TiledMap(TiledElement):
         :param optional_gids: load specific tile image GID, even if never used
         :param invert_y: invert the y axis
         :param load_all_tiles: load all tile images, even if never used
+        :param lazy_images: load each tile image on first access
+        :param prewarm: load the images used by visible tile layers up front
         :param allow_duplicate_names: allow duplicates in objects' metatdata
+        :param cache_dir: directory for the binary map cache, None disables it
+        :param defer_images: only parse the map, call reload_images later
+        :param image_decoder: function decoding a tileset image for the
+            image loader (see decode_images)
 
         image_loader:
           this must be a reference to a function that will accept a tuple:
@@ -299,11 +532,17 @@ class TiledMap(TiledElement):
         TiledElement.__init__(self)
         self.filename = filename
         self.image_loader = image_loader
+        self.image_decoder = kwargs.get('image_decoder', None)
+        self.decoded_images = dict()  # image path -> result of image_decoder
 
         # optional keyword arguments checked here
         self.optional_gids = kwargs.get('optional_gids', set())
         self.load_all_tiles = kwargs.get('load_all', True)
+        self.lazy_images = kwargs.get('lazy_images', True)
+        self.prewarm = kwargs.get('prewarm', False)
         self.invert_y = kwargs.get('invert_y', True)
+        self.cache_dir = kwargs.get('cache_dir', None)
+        self.defer_images = kwargs.get('defer_images', False)
 
         # allow duplicate names to be parsed and loaded
         TiledElement.allow_duplicate_names = \
@@ -315,6 +554,12 @@ class TiledMap(TiledElement):
         self.layernames = dict()
         self.objects_by_id = dict()
         self.objects_by_name = dict()
+        self.shared_tilesets = dict()  # tsx path -> SharedTileset
+
+        # maps dropped without release() give their tilesets back when
+        # collected; the finalizer must not reference the map itself
+        weakref.finalize(self, tileset_registry.release_all,
+                         self.shared_tilesets)
 
         # only used tiles are actually loaded, so there will be a difference
         # between the GIDs in the Tiled map data (tmx) and the data in this
@@ -345,7 +590,7 @@ class TiledMap(TiledElement):
         # initialize the gid mapping
         self.imagemap[(0, 0)] = 0
 
-        if filename:
+        if filename and not self.load_cache():
             self.parse_xml(ElementTree.parse(self.filename).getroot())
 
     def __repr__(self):
@@ -413,9 +658,169 @@ class TiledMap(TiledElement):
             if self.invert_y:
                 o.y -= o.height
 
-        self.reload_images()
+        # the cache holds parsed data only, so write it before any images
+        # are loaded (loading may register more gids)
+        if self.cache_dir and self.filename:
+            self.write_cache()
+
+        # images are set up by the caller, e.g. when parsing on a thread
+        # that must not touch the display
+        if not self.defer_images:
+            self.reload_images()
         return self
 
+    def cache_path(self):
+        """ Return the path of the binary cache file for this map
+
+        :rtype: str
+        """
+        name = os.path.basename(self.filename)
+        return os.path.join(self.cache_dir, name + CACHE_EXTENSION)
+
+    def cache_digest(self):
+        """ Hash the contents of the tmx file and its external tilesets
+
+        The digest also covers the options that change the parsed data, so a
+        cache written with different options is never used.
+
+        :rtype: bytes, 20 byte sha1 digest
+        """
+        digest = hashlib.sha1()
+        digest.update(str((CACHE_VERSION, self.invert_y)).encode())
+        with open(self.filename, 'rb') as fh:
+            tmx_data = fh.read()
+        digest.update(tmx_data)
+
+        dirname = os.path.dirname(self.filename)
+        for source in tileset_source_pattern.findall(tmx_data):
+            path = os.path.join(dirname, source.decode('utf-8'))
+            with open(path, 'rb') as fh:
+                digest.update(fh.read())
+
+        return digest.digest()
+
+    def write_cache(self):
+        """ Write the parsed map to the binary cache
+
+        Tile layer data is stored as one contiguous block of 32-bit gids,
+        everything else is pickled as plain data (no parent references).
+
+        :return: None
+        """
+        def element_state(element):
+            state = dict(vars(element))
+            state.pop('parent', None)
+            return state
+
+        layers = list()
+        layer_data = array.array(uint32_typecode)
+        for layer in self.layers:
+            state = element_state(layer)
+            items = None
+            if isinstance(layer, TiledTileLayer):
+                del state['data']
+                for row in layer.data:
+                    layer_data.fromlist(list(row))
+            elif isinstance(layer, TiledObjectGroup):
+                items = [element_state(o) for o in layer]
+            layers.append((type(layer).__name__, state, items))
+
+        excluded = ('filename', 'image_loader', 'images', 'layers',
+                    'tilesets', 'layernames', 'objects_by_id',
+                    'objects_by_name', 'optional_gids', 'load_all_tiles',
+                    'lazy_images', 'prewarm', 'invert_y', 'cache_dir',
+                    'shared_tilesets', 'defer_images', 'image_decoder',
+                    'decoded_images')
+        meta = {
+            'map': {k: v for k, v in vars(self).items() if k not in excluded},
+            'layers': layers,
+            'tilesets': [element_state(ts) for ts in self.tilesets],
+        }
+
+        try:
+            meta = pickle.dumps(meta, pickle.HIGHEST_PROTOCOL)
+            data = layer_data.tobytes()
+            header = cache_header.pack(CACHE_MAGIC, CACHE_VERSION,
+                                       self.cache_digest(), len(meta),
+                                       len(data))
+            os.makedirs(self.cache_dir, exist_ok=True)
+            path = self.cache_path()
+            tmp_path = path + '.tmp'
+            with open(tmp_path, 'wb') as fh:
+                fh.write(header)
+                fh.write(meta)
+                fh.write(data)
+            os.replace(tmp_path, path)
+        except (OSError, pickle.PicklingError) as e:
+            msg = 'Cannot write map cache for {0}: {1}'
+            logger.warning(msg.format(self.filename, e))
+
+    def load_cache(self):
+        """ Load the map from the binary cache, if a valid one exists
+
+        The cache is only used if its version and digest match the current
+        tmx and tsx files.  Images are loaded as usual after the data.
+
+        :rtype: bool, True if the map was loaded from the cache
+        """
+        if not self.cache_dir:
+            return False
+
+        try:
+            with open(self.cache_path(), 'rb') as fh:
+                header = fh.read(cache_header.size)
+                if len(header) != cache_header.size:
+                    return False
+                magic, version, digest, meta_size, data_size = \
+                    cache_header.unpack(header)
+                if (magic != CACHE_MAGIC or version != CACHE_VERSION or
+                        digest != self.cache_digest()):
+                    return False
+                meta = pickle.loads(fh.read(meta_size))
+                layer_data = array.array(uint32_typecode)
+                layer_data.frombytes(fh.read(data_size))
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError, EOFError, pickle.UnpicklingError) as e:
+            msg = 'Ignoring unreadable map cache for {0}: {1}'
+            logger.warning(msg.format(self.filename, e))
+            return False
+
+        def restore(cls, state):
+            element = cls.__new__(cls)
+            element.__dict__.update(state)
+            element.parent = self
+            return element
+
+        self.__dict__.update(meta['map'])
+        for state in meta['tilesets']:
+            tileset = restore(TiledTileset, state)
+            if tileset.shared_path:
+                self.acquire_tileset(tileset.shared_path)
+            self.add_tileset(tileset)
+
+        element_types = {cls.__name__: cls for cls in
+                         (TiledTileLayer, TiledImageLayer, TiledObjectGroup)}
+        offset = 0
+        for type_name, state, items in meta['layers']:
+            layer = restore(element_types[type_name], state)
+            if isinstance(layer, TiledTileLayer):
+                width, height = layer.width, layer.height
+                layer.data = tuple(
+                    layer_data[i:i + width]
+                    for i in range(offset, offset + width * height, width))
+                offset += width * height
+            elif isinstance(layer, TiledObjectGroup):
+                layer.extend(restore(TiledObject, o) for o in items)
+                for obj in layer:
+                    self.objects_by_id[obj.id] = obj
+                    self.objects_by_name[obj.name] = obj
+            self.add_layer(layer)
+
+        if not self.defer_images:
+            self.reload_images()
+        return True
+
     def reload_images(self):
         """ Load the map images from disk
 
@@ -423,9 +828,12 @@ class TiledMap(TiledElement):
         to do the loading or will use a generic default, in which case no
         images will be loaded.
 
+        With lazy_images, tile images are only registered here and loaded
+        the first time they are looked up in self.images.
+
         :return: None
         """
-        self.images = [None] * self.maxgid
+        self.images = LazyImageTable(self.maxgid)
 
         # iterate through tilesets to get source images
         for ts in self.tilesets:
@@ -434,9 +842,7 @@ class TiledMap(TiledElement):
             if ts.source is None:
                 continue
 
-            path = os.path.join(os.path.dirname(self.filename), ts.source)
-            colorkey = getattr(ts, 'trans', None)
-            loader = self.image_loader(path, colorkey, tileset=ts)
+            load_tile = self._make_tile_loader(ts)
 
             p = product(range(ts.margin,
                               ts.height + ts.margin - ts.tileheight + 1,
@@ -461,7 +867,12 @@ class TiledMap(TiledElement):
                     # flags might rotate/flip the image, so let the loader
                     # handle that here
                     for gid, flags in gids:
-                        self.images[gid] = loader(rect, flags)
+                        if gid >= len(self.images):
+                            self.images.extend([None] * (gid + 1 - len(self.images)))
+                        if self.lazy_images:
+                            self.images.defer(gid, load_tile, rect, flags)
+                        else:
+                            self.images[gid] = load_tile(rect, flags)
 
         # load image layer images
         for layer in (i for i in self.layers if isinstance(i, TiledImageLayer)):
@@ -488,6 +899,123 @@ class TiledMap(TiledElement):
                 image = loader()
                 self.images[real_gid] = image
 
+        if self.prewarm:
+            self.prewarm_images()
+
+    def decode_images(self):
+        """ Decode the images of tilesets used by visible tile layers
+
+        Decoding with image_decoder does not need the display, so with
+        defer_images it can be done on the same thread as parsing.  The
+        image loader gets the decoded image when the first tile of a
+        tileset is loaded and only has to convert it.  Other tilesets are
+        read by the image loader when needed.
+
+        :return: None
+        """
+        if self.image_decoder is None:
+            return
+
+        used = set()
+        for gid in self.visible_gids():
+            try:
+                used.add(self.get_tileset_from_gid(gid))
+            except ValueError:
+                pass
+
+        for ts in self.tilesets:
+            if ts.source is None or ts not in used:
+                continue
+            path = os.path.join(os.path.dirname(self.filename), ts.source)
+            if path not in self.decoded_images:
+                self.decoded_images[path] = self.image_decoder(path)
+
+    def _make_tile_loader(self, tileset):
+        """ Return a function that loads a tile image of a tileset
+
+        Images of external tilesets are looked up in (and added to) the
+        shared tileset, and the tileset image is only read from disk when a
+        tile is missing.
+
+        :param tileset: TiledTileset
+        :return: function taking a tile rect and flags
+        """
+        path = os.path.join(os.path.dirname(self.filename), tileset.source)
+        colorkey = getattr(tileset, 'trans', None)
+        image_loader = self.image_loader
+        shared = self.shared_tilesets.get(tileset.shared_path)
+        images = shared.images if shared else dict()
+        loader = None
+
+        def load_tile(rect, flags):
+            nonlocal loader
+            key = (image_loader, rect, flags if flags and any(flags) else None)
+            image = images.get(key)
+            if image is None:
+                if loader is None:
+                    decoded = self.decoded_images.pop(path, None)
+                    loader = image_loader(path, colorkey, tileset=tileset,
+                                          decoded=decoded)
+                image = images[key] = loader(rect, flags)
+            return image
+
+        return load_tile
+
+    def visible_gids(self):
+        """ Return the set of gids used by the visible tile layers
+
+        :rtype: set
+        """
+        gids = set()
+        for i in self.visible_tile_layers:
+            for row in self.layers[i].data:
+                gids.update(row)
+        gids.discard(0)
+        return gids
+
+    def prewarm_images(self):
+        """ Load the images of every gid used by the visible tile layers
+
+        :return: None
+        """
+        images = self.images
+        for gid in self.visible_gids():
+            images[gid]
+
+    def acquire_tileset(self, path):
+        """ Take a reference to a shared external tileset
+
+        :param path: absolute path of the tsx file
+        :rtype: SharedTileset
+        """
+        shared = self.shared_tilesets.get(path)
+        if shared is None:
+            shared = tileset_registry.acquire(path)
+            self.shared_tilesets[path] = shared
+        return shared
+
+    def acquire_tilesets(self):
+        """ Take references to the shared tilesets of this map again
+
+        Use this when a map that has been released is used again.
+
+        :return: None
+        """
+        for tileset in self.tilesets:
+            if tileset.shared_path:
+                self.acquire_tileset(tileset.shared_path)
+
+    def release(self):
+        """ Release the shared tilesets used by this map
+
+        Call this when the map is no longer used, so that tilesets (and their
+        images) that no other map needs can be freed right away.  Otherwise
+        they are released when the map is garbage collected.
+
+        :return: None
+        """
+        tileset_registry.release_all(self.shared_tilesets)
+
     def get_tile_image(self, x, y, layer):
         """ Return the tile image for this location
 
@@ -821,6 +1349,7 @@ class TiledTileset(TiledElement):
         # defaults from the specification
         self.firstgid = 0
         self.source = None
+        self.shared_path = None
         self.name = None
         self.tilewidth = 0
         self.tileheight = 0
@@ -857,17 +1386,14 @@ class TiledTileset(TiledElement):
 
                 # we need to mangle the path - tiled stores relative paths
                 dirname = os.path.dirname(self.parent.filename)
-                path = os.path.abspath(os.path.join(dirname, source))
+                path = os.path.realpath(os.path.join(dirname, source))
                 if not os.path.exists(path):
                     #raise OSError(errno.ENOENT, os.strerror(errno.ENOENT), path)
                     raise Exception("Cannot find tileset file {0} from {1}, should be at {2}".format(source, self.parent.filename, path))
-                
-                try:
-                    node = ElementTree.parse(path).getroot()
-                except IOError as io:
-                    msg = "Error loading external tileset: {0}"
-                    logger.error(msg.format(path))
-                    raise Exception(msg.format(path)) from io
+
+                # the parsed tsx is shared between all maps using it
+                self.shared_path = path
+                node = self.parent.acquire_tileset(path).root
             else:
                 msg = "Found external tileset, but cannot handle type: {0}"
                 logger.error(msg.format(self.source))
@@ -1002,12 +1528,9 @@ class TiledTileLayer(TiledElement):
         :param node: ElementTree xml node
         :return: self
         """
-        import struct
-        import array
-
         self._set_properties(node)
         data = None
-        next_gid = None
+        raw_gids = None
         data_node = node.find('data')
         chunk_nodes = data_node.findall('chunk')
         if chunk_nodes:
@@ -1022,8 +1545,7 @@ class TiledTileLayer(TiledElement):
             data = b64decode(data_node.text.strip())
 
         elif encoding == 'csv':
-            next_gid = map(int, "".join(
-                line.strip() for line in data_node.text.strip()).split(","))
+            raw_gids = parse_csv_gids(data_node.text)
 
         elif encoding:
             msg = 'TMX encoding type: {0} is not supported.'
@@ -1033,6 +1555,7 @@ class TiledTileLayer(TiledElement):
         compression = data_node.get('compression', None)
         if compression == 'gzip':
             import gzip
+            from io import BytesIO
 
             with gzip.GzipFile(fileobj=BytesIO(data)) as fh:
                 data = fh.read()
@@ -1050,30 +1573,29 @@ class TiledTileLayer(TiledElement):
         # if data is None, then it was not decoded or decompressed, so
         # we assume here that it is going to be a bunch of tile elements
         # TODO: this will/should raise an exception if there are no tiles
-        if encoding == next_gid is None:
-            def get_children(parent):
-                for child in parent.findall('tile'):
-                    yield int(child.get('gid'))
-
-            next_gid = get_children(data_node)
+        if encoding is None:
+            raw_gids = array.array(uint32_typecode, (
+                int(child.get('gid')) for child in data_node.findall('tile')))
 
         elif data:
             if type(data) == bytes:
-                fmt = struct.Struct('<L')
-                iterator = (data[i:i + 4] for i in range(0, len(data), 4))
-                next_gid = (fmt.unpack(i)[0] for i in iterator)
+                raw_gids = parse_binary_gids(data)
             else:
                 msg = 'layer data not in expected format ({})'
                 logger.error(msg.format(type(data)))
                 raise Exception(msg.format(type(data)))
 
-        init = lambda: [0] * self.width
-        reg = self.parent.register_gid
+        size = self.width * self.height
+        if raw_gids is None or len(raw_gids) != size:
+            msg = 'Layer "{0}" has {1} tiles, expected {2}'
+            found = 0 if raw_gids is None else len(raw_gids)
+            logger.error(msg.format(self.name, found, size))
+            raise Exception(msg.format(self.name, found, size))
 
         # H (16-bit) may be a limitation for very detailed maps
-        self.data = tuple(array.array('H', init()) for i in range(self.height))
-        for (y, x) in product(range(self.height), range(self.width)):
-            self.data[y][x] = reg(*decode_gid(next(next_gid)))
+        gids = decode_layer_gids(raw_gids, self.parent.register_gid)
+        self.data = tuple(gids[i:i + self.width]
+                          for i in range(0, size, self.width))
 
         return self
 
@@ -17,7 +17,6 @@ GNU Lesser General Public License for more details.
 You should have received a copy of the GNU Lesser General Public
 License along with pytmx.  If not, see <http://www.gnu.org/licenses/>.
 """
-import itertools
 import logging
 
 import pytmx
@@ -31,7 +30,8 @@ except ImportError:
     logger.error('cannot import pygame (is it installed?)')
     raise
 
-__all__ = ['load_pygame', 'pygame_image_loader', 'simplify', 'build_rects']
+__all__ = ['load_pygame', 'pygame_image_loader', 'pygame_sheet_loader',
+           'decode_sheet', 'simplify', 'build_rects', 'greedy_mesh']
 
 
 def handle_transformation(tile, flags):
@@ -117,6 +117,128 @@ def pygame_image_loader(filename, colorkey, **kwargs):
     return load_image
 
 
+def decode_sheet(filename):
+    """ Decode a tileset image for pygame_sheet_loader
+
+    The image is read and its transparency mask built, but it is not
+    converted, so the display is not needed and this can be run on a
+    background thread.
+
+    :param filename:
+    :return: (image, mask), mask is None without the mask module
+    """
+    image = pygame.image.load(filename)
+    try:
+        mask = pygame.mask.from_surface(image, 127)
+    except:
+        mask = None
+    return image, mask
+
+
+def pygame_sheet_loader(filename, colorkey, **kwargs):
+    """ pytmx image loader for pygame that converts the tileset only once
+
+    The whole tileset image is converted to the display format (once without
+    and, if needed, once with per-pixel alpha) and untransformed tiles are
+    returned as subsurfaces of it, so no pixels are copied per tile.
+    Transparency is analysed with one mask for the whole sheet; the result
+    for each tile is kept in a small table.
+
+    Flipped or rotated tiles are copied and converted with smart_convert.
+    TiledMap caches every loaded tile by rect and flags, so each variant is
+    only made once.
+
+    If the image was decoded already (decode_sheet), it is passed in the
+    'decoded' keyword argument and not read again.
+
+    :param filename:
+    :param colorkey:
+    :param kwargs:
+    :return:
+    """
+    if colorkey:
+        colorkey = pygame.Color('#{0}'.format(colorkey))
+
+    pixelalpha = kwargs.get('pixelalpha', True)
+    sheets = dict()  # converted sheets, by 'colorkey', 'opaque' or 'alpha'
+    opaque_tiles = dict()  # tile rect -> True if it has no transparent pixels
+    masks = dict()
+
+    decoded = kwargs.get('decoded')
+    if decoded is None:
+        image = pygame.image.load(filename)
+    else:
+        image, mask = decoded
+        if mask is not None:
+            masks['sheet'] = mask
+
+    def get_sheet(kind):
+        try:
+            return sheets[kind]
+        except KeyError:
+            pass
+
+        # no RLEACCEL here, subsurfaces of RLE surfaces are slow to blit
+        if kind == 'colorkey':
+            sheet = image.convert()
+            sheet.set_colorkey(colorkey)
+        elif kind == 'alpha':
+            sheet = image.convert_alpha()
+        else:
+            sheet = image.convert()
+        sheets[kind] = sheet
+        return sheet
+
+    def is_opaque(rect):
+        try:
+            return opaque_tiles[rect]
+        except KeyError:
+            pass
+
+        x, y, w, h = rect
+        try:
+            if 'sheet' not in masks:
+                masks['sheet'] = pygame.mask.from_surface(image, 127)
+            if (w, h) not in masks:
+                masks[(w, h)] = pygame.mask.Mask((w, h), fill=True)
+            px = masks['sheet'].overlap_area(masks[(w, h)], (x, y))
+        except:
+            # pygame_sdl2 will fail because the mask module is not included
+            # in this case, treat every tile as transparent
+            px = 0
+
+        opaque_tiles[rect] = opaque = px == w * h
+        return opaque
+
+    def load_image(rect=None, flags=None):
+        if not rect:
+            return smart_convert(image.copy(), colorkey, pixelalpha)
+
+        if flags and any(flags):
+            try:
+                tile = image.subsurface(rect)
+            except ValueError:
+                logger.error('Tile bounds outside bounds of tileset image')
+                raise
+            tile = handle_transformation(tile, flags)
+            return smart_convert(tile, colorkey, pixelalpha)
+
+        if colorkey:
+            sheet = get_sheet('colorkey')
+        elif pixelalpha and not is_opaque(rect):
+            sheet = get_sheet('alpha')
+        else:
+            sheet = get_sheet('opaque')
+
+        try:
+            return sheet.subsurface(rect)
+        except ValueError:
+            logger.error('Tile bounds outside bounds of tileset image')
+            raise
+
+    return load_image
+
+
 def load_pygame(filename, *args, **kwargs):
     """ Load a TMX file, images, and return a TiledMap class
 
@@ -132,28 +254,39 @@ def load_pygame(filename, *args, **kwargs):
     transparency set in Tiled, the util_pygam will return images that have their
     transparency already set.
 
+    by default tiles are subsurfaces of one converted tileset image (see
+    pygame_sheet_loader).  pass sheet_views=False to get a separate surface
+    for every tile instead.
+
     TL;DR:
     Don't attempt to convert() or convert_alpha() the individual tiles.  It is
     already done for you.
     """
-    kwargs['image_loader'] = pygame_image_loader
+    if kwargs.get('sheet_views', True):
+        kwargs['image_loader'] = pygame_sheet_loader
+        kwargs.setdefault('image_decoder', decode_sheet)
+    else:
+        kwargs['image_loader'] = pygame_image_loader
     return pytmx.TiledMap(filename, *args, **kwargs)
 
 
-def build_rects(tmxmap, layer, tileset=None, real_gid=None):
+def build_rects(tmxmap, layer, tileset=None, real_gid=None, properties=None):
     """generate a set of non-overlapping rects that represents the distribution
        of the specified gid.
 
     useful for generating rects for use in collision detection
 
-    Use at your own risk: this is experimental...will change in future
+    Tiles are included if they are not empty and match all of the filters
+    given: tileset, real_gid and properties.  Without filters, all tiles
+    of the layer are included.  Runs in time linear to the layer size.
 
     GID Note: You will need to add 1 to the GID reported by Tiled.
 
     :param tmxmap: TiledMap object
-    :param layer: int or string name of layer
+    :param layer: int index or string name of a tile layer
     :param tileset: int or string name of tileset
     :param real_gid: Tiled GID of the tile + 1 (see note)
+    :param properties: dict of tile properties the tile must have
     :return: List of pygame Rect objects
     """
     if isinstance(tileset, int):
@@ -181,41 +314,112 @@ def build_rects(tmxmap, layer, tileset=None, real_gid=None):
     if real_gid:
         try:
             gid, flags = tmxmap.map_gid(real_gid)[0]
-        except IndexError:
+        except (IndexError, TypeError):
             msg = "GID #{0} not found"
             logger.debug(msg.format(real_gid))
             raise ValueError
 
     if isinstance(layer, int):
-        layer_data = tmxmap.get_layer_data(layer)
-    elif isinstance(layer, str):
         try:
-            layer = [l for l in tmxmap.layers if l.name == layer].pop()
-            layer_data = layer.data
+            layer = tmxmap.layers[layer]
         except IndexError:
+            msg = "Layer #{0} not found in map {1}."
+            logger.debug(msg.format(layer, tmxmap))
+            raise IndexError
+
+    elif isinstance(layer, str):
+        try:
+            layer = tmxmap.get_layer_by_name(layer)
+        except ValueError:
             msg = "Layer \"{0}\" not found in map {1}."
             logger.debug(msg.format(layer, tmxmap))
-            raise ValueError
+            raise
 
-    p = itertools.product(range(tmxmap.width), range(tmxmap.height))
-    if gid:
-        points = [(x, y) for (x, y) in p if layer_data[y][x] == gid]
-    else:
-        points = [(x, y) for (x, y) in p if layer_data[y][x]]
+    if not isinstance(layer, pytmx.TiledTileLayer):
+        msg = "Layer must be a tile layer. got: {0}"
+        logger.debug(msg.format(type(layer)))
+        raise TypeError
+
+    # filters are checked once per distinct gid, not once per tile
+    matches = dict()
+
+    def match(_gid):
+        if gid is not None and _gid != gid:
+            return False
+        if tileset and tmxmap.get_tileset_from_gid(_gid) is not tileset:
+            return False
+        if properties:
+            props = tmxmap.get_tile_properties_by_gid(_gid) or {}
+            return all(props.get(k) == v for k, v in properties.items())
+        return True
+
+    width = tmxmap.width
+    mask = bytearray(width * tmxmap.height)
+    for y, row in enumerate(layer.data):
+        for x, _gid in enumerate(row):
+            if _gid:
+                try:
+                    hit = matches[_gid]
+                except KeyError:
+                    hit = matches[_gid] = match(_gid)
+                if hit:
+                    mask[y * width + x] = 1
+
+    return greedy_mesh(mask, width, tmxmap.tilewidth, tmxmap.tileheight)
+
+
+def greedy_mesh(mask, width, tilewidth, tileheight, offset=(0, 0)):
+    """Given a bitmap of tiles, return list of rects that cover it
+
+    mask is a bytearray (or other mutable sequence) of width * height
+    values, row by row; nonzero values are covered.  The mask is
+    consumed: covered values are set to 0.
+
+    Scanning in row order, each rect starts at the first uncovered tile,
+    grows right as far as the row allows and then down as far as whole
+    rows allow.  Every tile is visited a constant number of times, so
+    this runs in time linear to the size of the mask.
+
+    :param mask: bytearray of width * height values
+    :param width: width of the mask in tiles
+    :param tilewidth: width of a tile in pixels
+    :param tileheight: height of a tile in pixels
+    :param offset: (x, y) tile of the first value of the mask
+    :return: List of non-overlapping pygame Rect objects
+    """
+    height = len(mask) // width
+    ox, oy = offset
+    rects = list()
+
+    for i in range(len(mask)):
+        if not mask[i]:
+            continue
+
+        x, y = i % width, i // width
+        end = x + 1
+        while end < width and mask[y * width + end]:
+            end += 1
+
+        bottom = y + 1
+        while bottom < height:
+            start = bottom * width
+            if not all(mask[start + x:start + end]):
+                break
+            bottom += 1
+
+        for row in range(y, bottom):
+            start = row * width
+            mask[start + x:start + end] = bytes(end - x)
+
+        rects.append(pygame.Rect((ox + x) * tilewidth, (oy + y) * tileheight,
+                                 (end - x) * tilewidth,
+                                 (bottom - y) * tileheight))
 
-    rects = simplify(points, tmxmap.tilewidth, tmxmap.tileheight)
     return rects
 
 
 def simplify(all_points, tilewidth, tileheight):
     """Given a list of points, return list of rects that represent them
-    kludge:
-
-    "A kludge (or kluge) is a workaround, a quick-and-dirty solution,
-    a clumsy or inelegant, yet effective, solution to a problem, typically
-    using parts that are cobbled together."
-
-    -- wikipedia
 
     turn a list of points into a rects
     adjacent rects will be combined.
@@ -243,52 +447,19 @@ def simplify(all_points, tilewidth, tileheight):
         ..............
         ....##########
 
-        pretty cool, right?
-
     there may be cases where the number of rectangles is not as low as possible,
-    but I haven't found that it is excessively bad.  certainly much better than
-    making a list of rects, one for each tile on the map!
+    but it is much better than making a list of rects, one for each tile on
+    the map!  see greedy_mesh.
     """
-
-    def pick_rect(points, rects):
-        ox, oy = sorted([(sum(p), p) for p in points])[0][1]
-        x = ox
-        y = oy
-        ex = None
-
-        while 1:
-            x += 1
-            if not (x, y) in points:
-                if ex is None:
-                    ex = x - 1
-
-                if (ox, y + 1) in points:
-                    if x == ex + 1:
-                        y += 1
-                        x = ox
-
-                    else:
-                        y -= 1
-                        break
-                else:
-                    if x <= ex: y -= 1
-                    break
-
-        c_rect = pygame.Rect(ox * tilewidth, oy * tileheight,
-                             (ex - ox + 1) * tilewidth,
-                             (y - oy + 1) * tileheight)
-
-        rects.append(c_rect)
-
-        rect = pygame.Rect(ox, oy, ex - ox + 1, y - oy + 1)
-        kill = [p for p in points if rect.collidepoint(p)]
-        [points.remove(i) for i in kill]
-
-        if points:
-            pick_rect(points, rects)
-
-    rect_list = []
-    while all_points:
-        pick_rect(all_points, rect_list)
-
-    return rect_list
+    if not all_points:
+        return list()
+
+    xs = [x for x, y in all_points]
+    ys = [y for x, y in all_points]
+    left, top = min(xs), min(ys)
+    width = max(xs) - left + 1
+    mask = bytearray(width * (max(ys) - top + 1))
+    for x, y in all_points:
+        mask[(y - top) * width + x - left] = 1
+
+    return greedy_mesh(mask, width, tilewidth, tileheight, (left, top))
@@ -0,0 +1,211 @@
+import json
+import os
+import struct
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import constants as c
+import tools
+
+# Save file: magic, format version, payload length and crc32, followed by
+# the payload, zlib compressed JSON. Bump SAVE_VERSION whenever the layout
+# of the saved data changes.
+SAVE_MAGIC = b'QSAV'
+SAVE_VERSION = 1
+save_header = struct.Struct('<4sHII')
+
+def game_data_to_save(game_data, position):
+    """
+    Returns game data as plain data for saving: sets become sorted lists
+    and quests are saved by their state, not as objects. position is
+    player's (x, y, direction) on the current map.
+    """
+    player_data = game_data['player_data']
+    x, y, direction = position
+
+    return {'map': game_data['current_map'],
+            'player': {'x': x, 'y': y, 'direction': direction},
+            'inventory': {'gold': player_data['gold'],
+                          'hearts': player_data['hearts'],
+                          'chickens': dict(player_data['chickens']),
+                          'found_items': sorted(player_data['found_items']),
+                          'catched_chickens':
+                              sorted(player_data['catched_chickens'])},
+            'quests': {name: {'step': quest['i'],
+                              'active': quest['class_name'].active,
+                              'completed': quest['class_name'].completed}
+                       for name, quest in game_data['quest_data'].items()},
+            'active_quests': sorted(game_data['active_quests'])}
+
+def save_to_game_data(save):
+    """
+    Returns new game data dictionary with the saved state. Player position
+    is stored as game_data['spawn'] for the map to pick up.
+    """
+    game_data = tools.create_game_data_dict()
+    player_data = game_data['player_data']
+    inventory = save['inventory']
+
+    player_data['gold'] = inventory['gold']
+    player_data['hearts'] = inventory['hearts']
+    player_data['chickens'].update(inventory['chickens'])
+    player_data['found_items'] = set(inventory['found_items'])
+    player_data['catched_chickens'] = set(inventory['catched_chickens'])
+
+    for name, state in save['quests'].items():
+        quest = game_data['quest_data'][name]
+        quest['i'] = state['step']
+        quest['class_name'].active = state['active']
+        quest['class_name'].completed = state['completed']
+
+    game_data['active_quests'] = set(save['active_quests'])
+    game_data['current_map'] = save['map']
+    player = save['player']
+    game_data['spawn'] = (player['x'], player['y'], player['direction'])
+    return game_data
+
+def encode(save):
+    payload = zlib.compress(
+        json.dumps(save, separators=(',', ':')).encode('utf-8'))
+    header = save_header.pack(SAVE_MAGIC, SAVE_VERSION, len(payload),
+                              zlib.crc32(payload))
+    return header + payload
+
+def decode(data):
+    """
+    Returns saved data, or raises ValueError if data is not a valid save
+    of the current version.
+    """
+    if len(data) < save_header.size:
+        raise ValueError('truncated header')
+    magic, version, length, crc = save_header.unpack_from(data)
+    if magic != SAVE_MAGIC:
+        raise ValueError('not a save file')
+    if version != SAVE_VERSION:
+        raise ValueError('save version {}, expected {}'.format(
+            version, SAVE_VERSION))
+
+    payload = data[save_header.size:]
+    if len(payload) != length or zlib.crc32(payload) != crc:
+        raise ValueError('corrupted save')
+    return json.loads(zlib.decompress(payload).decode('utf-8'))
+
+
+class SaveFile:
+    """
+    Saved game on disk, zlib compressed JSON after a short header. Saving
+    takes a snapshot of game data on the calling thread, and encodes and
+    writes it on a background thread, so it does not stall frames. Files
+    are replaced atomically, so a save interrupted midway leaves the
+    previous one intact.
+
+    Latencies of the last save (snapshot and write) and load are kept for
+    the report.
+    """
+    def __init__(self, path=c.SAVE_FILE):
+        self.path = path
+        self.executor = None
+        self.pending = None # Future of write in progress.
+        self.lock = threading.Lock()
+
+        self.saves = 0
+        self.snapshot_time = 0.0
+        self.write_time = 0.0
+        self.load_time = 0.0
+        self.size = 0
+        self.error = None # Reason why the last save or load failed.
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def save(self, game_data, position):
+        """
+        Saves game with player at position (x, y, direction) in the
+        background.
+        """
+        start = time.perf_counter()
+        save = game_data_to_save(game_data, position)
+        self.snapshot_time = time.perf_counter() - start
+
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix='save_game')
+        self.pending = self.executor.submit(self.write, save)
+
+    def write(self, save):
+        """
+        Encodes save and writes it to a temporary file that then replaces
+        the save file. Failures are left to error, as nothing waits for
+        the result.
+        """
+        start = time.perf_counter()
+        tmp_path = self.path + '.tmp'
+        try:
+            data = encode(save)
+            with self.lock:
+                with open(tmp_path, 'wb') as f:
+                    f.write(data)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, self.path)
+        except (OSError, TypeError, ValueError) as e:
+            self.error = 'cannot write {}: {}'.format(self.path, e)
+            return
+
+        self.write_time = time.perf_counter() - start
+        self.size = len(data)
+        self.saves += 1
+        self.error = None
+
+    def load(self):
+        """
+        Returns game data of the saved game, or None if there is no valid
+        save (reason is left to error).
+        """
+        self.wait()
+        start = time.perf_counter()
+        try:
+            with open(self.path, 'rb') as f:
+                data = f.read()
+            game_data = save_to_game_data(decode(data))
+        except FileNotFoundError:
+            self.error = 'no saved game'
+            return None
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            self.error = 'cannot load {}: {}'.format(self.path, e)
+            return None
+
+        self.load_time = time.perf_counter() - start
+        self.error = None
+        return game_data
+
+    def wait(self):
+        """
+        Waits for the write in progress.
+        """
+        if self.pending is not None:
+            self.pending.result()
+            self.pending = None
+
+    def shutdown(self):
+        self.wait()
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+
+    def stats(self):
+        return {'saves': self.saves,
+                'bytes': self.size,
+                'snapshot_ms': self.snapshot_time * 1000,
+                'write_ms': self.write_time * 1000,
+                'load_ms': self.load_time * 1000}
+
+    def report(self):
+        report = ('saves: {saves} size: {bytes} B '
+                  'snapshot: {snapshot_ms:.2f} ms write: {write_ms:.2f} ms '
+                  'load: {load_ms:.2f} ms').format(**self.stats())
+        if self.error is not None:
+            report += ' error: ' + self.error
+        return report
@@ -1,32 +1,56 @@
 import pygame as pg
 import os
+from collections import deque
 
 import constants as c
 import tools
+from map_cache import MapCache
+from savegame import SaveFile
 
 # Center game window.
 os.environ['SDL_VIDEO_CENTERED'] = 'TRUE'
 
-pg.init()
-pg.display.set_caption(c.CAPTION)
-display = pg.display.set_mode(c.DISPLAY_SIZE)
-surf_to_display = pg.Surface(c.DISPLAY_SIZE)
-window = pg.Surface(c.WINDOW_SIZE)
+if c.HEADLESS:
+    # No window or sound, only what game logic needs. Played sounds are 
+    # recorded to SFX_LOG and presented frames counted by PRESENTER.
+    pg.font.init()
+    PRESENTER = tools.NullPresenter()
+    window = pg.Surface(c.WINDOW_SIZE)
+    
+    GFX = tools.NullRegistry(pg.Surface((c.TILE_WIDTH, c.TILE_WIDTH)))
+    MUSIC = tools.NullRegistry(None)
+    SFX = {}
+    SFX_LOG = deque(maxlen=c.SFX_LOG_SIZE)
+else:
+    pg.init()
+    pg.display.set_caption(c.CAPTION)
+    PRESENTER = tools.Presenter()
+    window = pg.Surface(c.WINDOW_SIZE)
+    
+    GFX = tools.load_all_gfx(os.path.join('assets', 'graphics'))
+    MUSIC = tools.load_all_music(os.path.join('assets', 'music'))
+    SFX = tools.load_all_sfx(os.path.join('assets', 'sfx'))
+    
+    pg.display.set_icon(GFX['icon'])
 
-GFX = tools.load_all_gfx(os.path.join('assets', 'graphics'))
 TMX = tools.load_all_tmx(os.path.join('assets', 'tmx'))
 FONTS = tools.load_all_fonts(os.path.join('assets', 'fonts'))
-MUSIC = tools.load_all_music(os.path.join('assets', 'music'))
-SFX = tools.load_all_sfx(os.path.join('assets', 'sfx'))
-
-pg.display.set_icon(GFX['icon'])
+MAP_CACHE = MapCache(TMX)
+FRAMES = tools.FrameCache(GFX)
+SAVES = SaveFile(c.SAVE_FILE)
 
 def play_sfx(sound_name, volume=c.SFX_DEFAULT_VOLUME):
+    if c.HEADLESS:
+        SFX_LOG.append((sound_name, volume))
+        return
+    
     sound = SFX[sound_name]
     sound.set_volume(volume)
     sound.play()
 
-def update_display(window):
-    pg.transform.scale(window, c.DISPLAY_SIZE, surf_to_display)
-    display.blit(surf_to_display, (0, 0))
-    pg.display.flip()
\ No newline at end of file
+def update_display(window, rects=None):
+    """
+    Shows window on the display. If rects (in window coordinates) are 
+    given, only those parts are updated.
+    """
+    PRESENTER.present(window, rects)
@@ -0,0 +1,232 @@
+"""
+Runs many headless game sessions in parallel to stress test quests and
+collisions. Each session has its own game data and states, and is driven
+by a random or scripted input policy.
+
+    python simulate.py 8 --ticks 20000
+    python simulate.py 8 --script walk.json
+
+Maps are parsed once before the worker processes are forked, so the
+workers share them copy-on-write.
+
+A script is a JSON list of steps [keys, ticks] or [keys, ticks, presses],
+e.g. [[["RIGHT"], 60], [[], 1, ["SPACE"]]]. Keys are held for ticks,
+presses are sent as key down events on the first tick of the step.
+Key names are pygame key constants without 'K_'. Script is repeated.
+"""
+import os
+os.environ.setdefault('QUEST_HEADLESS', '1')
+
+import argparse
+import gc
+import json
+import multiprocessing
+import random
+import time
+
+import pygame as pg
+
+import constants as c
+import main
+import setup
+import tools
+
+MAPS = (c.SANDY_COVE, c.MYSTERIOUS_CAVE, c.TRANQUIL_CABIN, c.MAIN_MENU)
+MOVES = ([pg.K_UP], [pg.K_DOWN], [pg.K_LEFT], [pg.K_RIGHT], [])
+
+def key_down(key):
+    return pg.event.Event(pg.KEYDOWN, key=key)
+
+def start_game():
+    """
+    Input for main menu. Selector starts on 'Start a new game !'.
+    """
+    return tools.SyntheticKeys(), [key_down(pg.K_RETURN)]
+
+
+class RandomPolicy:
+    """
+    Holds a random arrow key (or none) for a random number of ticks and
+    now and then presses space to go through dialogues.
+    """
+    def __init__(self, seed):
+        self.rng = random.Random(seed)
+        self.keys = tools.SyntheticKeys()
+        self.hold = 0
+
+    def __call__(self, tick, gm):
+        if gm.state_name == c.MAIN_MENU:
+            return start_game()
+
+        if self.hold <= 0:
+            self.keys = tools.SyntheticKeys(self.rng.choice(MOVES))
+            self.hold = self.rng.randint(8, 90)
+        self.hold -= 1
+
+        events = []
+        if self.rng.random() < 0.01:
+            events.append(key_down(pg.K_SPACE))
+        return self.keys, events
+
+
+class ScriptPolicy:
+    """
+    Repeats a list of steps (keys, ticks, presses).
+    """
+    def __init__(self, steps):
+        self.steps = []
+        for step in steps:
+            keys, ticks = step[0], step[1]
+            presses = step[2] if len(step) > 2 else []
+            self.steps.append(([getattr(pg, 'K_' + key) for key in keys],
+                               ticks,
+                               [getattr(pg, 'K_' + key) for key in presses]))
+        self.index = -1
+        self.left = 0
+
+    def __call__(self, tick, gm):
+        if gm.state_name == c.MAIN_MENU:
+            return start_game()
+
+        events = []
+        if self.left <= 0:
+            self.index = (self.index + 1) % len(self.steps)
+            keys, self.left, presses = self.steps[self.index]
+            self.keys = tools.SyntheticKeys(keys)
+            events = [key_down(key) for key in presses]
+        self.left -= 1
+        return self.keys, events
+
+
+class SessionStats:
+    """
+    Follows a session's states for collision statistics. Each map
+    entered has a new OccupancyGrid, so counts are summed over them.
+    """
+    def __init__(self):
+        self.grid = None
+        self.collisions = {'moves': 0, 'blocked_moves': 0, 'checks': 0}
+        self.maps = []
+
+    def observe(self, gm):
+        grid = getattr(gm.state, 'occupancy', None)
+        if grid is self.grid:
+            return
+
+        self.finish()
+        self.grid = grid
+        self.maps.append(gm.state_name)
+
+    def finish(self):
+        if self.grid is not None:
+            stats = self.grid.stats()
+            for key in self.collisions:
+                self.collisions[key] += stats[key]
+            self.grid = None
+
+
+def run_session(job):
+    """
+    Runs one session in a worker and returns its statistics.
+    """
+    index, ticks, script = job
+    if script is None:
+        policy = RandomPolicy(index)
+    else:
+        policy = ScriptPolicy(script)
+    stats = SessionStats()
+
+    def session_input(tick, gm):
+        stats.observe(gm)
+        return policy(tick, gm)
+
+    start = time.perf_counter()
+    gm = main.run_headless(ticks, session_input)
+    seconds = time.perf_counter() - start
+    stats.observe(gm)
+    stats.finish()
+
+    game_data = gm.state.game_data
+    player = game_data['player_data']
+    quests = {name: {'completed': quest['class_name'].completed,
+                     'active': name in game_data['active_quests'],
+                     'step': quest['i']}
+              for name, quest in game_data['quest_data'].items()}
+
+    return {'session': index,
+            'ticks': ticks,
+            'seconds': seconds,
+            'map': gm.state_name,
+            'maps_entered': len(stats.maps),
+            'moves': stats.collisions['moves'],
+            'blocked_moves': stats.collisions['blocked_moves'],
+            'checks': stats.collisions['checks'],
+            'gold': player['gold'],
+            'hearts': player['hearts'],
+            'chickens': player['chickens']['amount'],
+            'quests': quests}
+
+def run(sessions, ticks, script=None, processes=None):
+    """
+    Runs sessions in a process pool and returns statistics of all of them
+    with aggregate ticks per second.
+    """
+    # Parse maps before forking so the workers share them. Freezing moves
+    # everything to a permanent generation, so that garbage collection in
+    # workers does not touch (and copy) those pages.
+    setup.MAP_CACHE.preload(MAPS)
+    gc.freeze()
+
+    if 'fork' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('fork')
+    else:
+        context = multiprocessing.get_context()
+
+    jobs = [(i, ticks, script) for i in range(sessions)]
+    start = time.perf_counter()
+    with context.Pool(processes) as pool:
+        results = pool.map(run_session, jobs)
+    seconds = time.perf_counter() - start
+
+    total_ticks = sessions * ticks
+    return {'sessions': results,
+            'ticks': total_ticks,
+            'seconds': seconds,
+            'ticks_per_second': total_ticks / seconds}
+
+def format_report(report):
+    lines = ['{} ticks in {:.2f} s, {:.0f} ticks/s'.format(
+        report['ticks'], report['seconds'], report['ticks_per_second'])]
+
+    for session in report['sessions']:
+        quests = ' '.join(
+            '{}: {}'.format(name, 'done' if quest['completed'] else
+                            'step {}'.format(quest['step']))
+            for name, quest in session['quests'].items())
+        lines.append(
+            '#{session} {tps:.0f} ticks/s map: {map} maps entered: '
+            '{maps_entered} moves: {moves} blocked: {blocked_moves} '
+            'checks: {checks} gold: {gold} '
+            'chickens: {chickens} '.format(
+                tps=session['ticks'] / session['seconds'], **session) + quests)
+
+    return '\n'.join(lines)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Run headless sessions.')
+    parser.add_argument('sessions', type=int)
+    parser.add_argument('--ticks', type=int, default=20000)
+    parser.add_argument('--script', help='JSON input script, random if not given')
+    parser.add_argument('--processes', type=int, default=None)
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse_args()
+    script = None
+    if args.script:
+        with open(args.script) as f:
+            script = json.load(f)
+
+    report = run(args.sessions, args.ticks, script, args.processes)
+    print(format_report(report))
+    setup.MAP_CACHE.shutdown()
@@ -2,100 +2,73 @@ import pygame as pg
 import random
 
 import constants as c
-from setup import GFX, FONTS, play_sfx
+from setup import GFX, FONTS, FRAMES, play_sfx
+from tools import interpolate
 
 class Sprite(pg.sprite.Sprite):
     """
     Base class for all game sprites. Can be used as is to create stationary 
     sprites. Moving and animation included. 
     Moving has to be initiated in children by overriding update method.
+    
+    Directions and actions are integer codes from constants. Animations, 
+    vectors and the action table are shared by all sprites of a class.
     """
-    def __init__(self, sheet_key, x, y, direction='down', action='resting'):
+    vectors = c.VECTORS
+    
+    def __init__(self, sheet_key, x, y, direction=c.DOWN, action=c.RESTING):
         super().__init__()
         self.name = sheet_key
         self.direction = direction
         self.action = action
         
-        self.action_dict = self.create_action_dict()
-        self.vector_dict = self.create_vector_dict()
-        self.spritesheet_dict = self.create_spritesheet_dict(sheet_key)
-        self.animation_dict = self.create_animation_dict()
+        self.animations = self.create_animations()
         
-        self.image_list = self.animation_dict[self.direction]
+        self.image_list = self.animations[self.direction]
         self.image = self.image_list[0]
         self.rect = self.image.get_rect(left=x, top=y)
+        self.previous_position = self.rect.topleft
         
         self.speed = 1
         self.distance = 0
         self.pixels_moved = 0
-
-        self.blockers = self.set_blockers()
         
-    def create_spritesheet_dict(self, sheet_key, tw=c.TILE_WIDTH):
+        # Set when sprite is added to an OccupancyGrid and a SpatialHash.
+        self.occupancy = None
+        self.spatial_hash = None
+    
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.create_action_table()
+    
+    @classmethod
+    def create_action_table(cls):
         """
-        Makes a dictionary of images from sprite sheet.
+        Builds the class-level table of action functions indexed by action 
+        code.
         """
-        image_list = []
-        image_dict = {}
-        sheet = GFX[sheet_key]
-        
-        # u = up, d = down, l = left, r = right
-        image_keys = ['u0', 'u1', 'u2', 'u3',
-                      'd0', 'd1', 'd2', 'd3',
-                      'l0', 'l1', 'l2', 'l3',
-                      'r0', 'r1', 'r2', 'r3']
-
-        for row in range(4):
-            for column in range(4):
-                image = pg.Surface([tw, tw])
-                image.blit(sheet, (0, 0), (column*tw, row*tw, tw, tw))
-                image.set_colorkey(c.WHITE)
-                image_list.append(image)
-                
-        for key, image in zip(image_keys, image_list):
-            image_dict[key] = image
-        
-        return image_dict    
+        cls.action_table = (cls.resting, cls.moving, cls.auto_moving)
     
-    def create_animation_dict(self, d = None):
+    def create_animations(self, sheet_key=None, tw=c.TILE_WIDTH):
         """
-        Returns a dictionary of image lists for animation.
+        Returns a tuple of image tuples for animation, indexed by direction. 
+        The images are shared through FRAMES and must not be modified.
         """
-        if d is None:
-            d = self.spritesheet_dict
+        if sheet_key is None:
+            sheet_key = self.name
         
-        up_list     = [d['u0'], d['u1'], d['u2'], d['u3']]
-        down_list   = [d['d0'], d['d1'], d['d2'], d['d3']]
-        left_list   = [d['l0'], d['l1'], d['l2'], d['l3']]
-        right_list  = [d['r0'], d['r1'], d['r2'], d['r3']]
-
-        direction_dict = {'up': up_list,
-                          'down': down_list,
-                          'left': left_list,
-                          'right': right_list}
-
-        return direction_dict
-    
-    def create_action_dict(self):
-        action_dict = {'resting': self.resting,
-                       'moving':  self.moving,
-                       'auto_moving': self.auto_moving
-        }
-        return action_dict
-    
-    def create_vector_dict(self):
-        vector_dict = {'up': (0, -1),
-                       'down': (0, 1),
-                       'left': (-1, 0),
-                       'right': (1, 0)
-        }
-        return vector_dict
+        return FRAMES.get_animations(sheet_key, tw)
     
     def update(self, dt):
-        self.blockers = self.set_blockers()
+        self.previous_position = self.rect.topleft
         self.dt = dt
-        action_function = self.action_dict[self.action]
-        action_function()
+        self.action_table[self.action](self)
+    
+    def interpolate(self, alpha):
+        """
+        Returns drawing position between the previous and the current tick.
+        """
+        return interpolate(self.previous_position, self.rect.topleft, alpha)
     
     def resting(self):
         self.correct_position()
@@ -116,9 +89,10 @@ class Sprite(pg.sprite.Sprite):
             pixels_to_move = int(round(self.distance))
             
             # move_ip moves rect by given x and y offset to self.direction.
-            self.rect.move_ip(
-                self.vector_dict[self.direction][0] * pixels_to_move,
-                self.vector_dict[self.direction][1] * pixels_to_move)
+            x, y = self.vectors[self.direction]
+            self.rect.move_ip(x * pixels_to_move, y * pixels_to_move)
+            if self.spatial_hash is not None:
+                self.spatial_hash.move(self)
             
             self.pixels_moved += pixels_to_move
             self.distance = 0
@@ -136,16 +110,30 @@ class Sprite(pg.sprite.Sprite):
         pass
     
     def begin_resting(self):
-        self.action = 'resting'
+        self.action = c.RESTING
         self.distance = 0
         self.pixels_moved = 0
         self.correct_position()
         self.image = self.image_list[0]
+        if self.occupancy is not None:
+            self.occupancy.finish_move(self)
+        if self.spatial_hash is not None:
+            self.spatial_hash.move(self)
     
     def begin_moving(self, direction):
-        self.action = 'moving'
+        """
+        Starts moving one tile to direction. If the tile is blocked in 
+        sprite's occupancy grid, sprite only turns to face direction.
+        """
         self.direction = direction
-        self.image_list = self.animation_dict[self.direction]
+        self.image_list = self.animations[direction]
+        
+        if (self.occupancy is not None and 
+            not self.occupancy.reserve_move(self, self.vectors[direction])):
+            self.image = self.image_list[0]
+            return
+        
+        self.action = c.MOVING
     
     def correct_position(self):
         """
@@ -166,36 +154,9 @@ class Sprite(pg.sprite.Sprite):
                 self.rect.y -= y_off
             else:
                 self.rect.y += (tw - y_off)
-    
-    def set_blockers(self, tw=c.TILE_WIDTH):
-        """
-        Creates blocker rects to prevent collision with other sprites.
-        If sprite is resting, blocker is sprite.rect.
-        If sprite is moving, blockers are the source and
-        the destination tile sprite is moving in between.
-        """
-        blockers = []
-        
-        x = self.rect.x
-        y = self.rect.y
-        
-        if self.pixels_moved == 0:
-            blockers.append(pg.Rect(self.rect.topleft, (tw, tw)))
-        else:
-            if self.rect.x % tw != 0:
-                tile1 = ( (x // tw) * tw , y)
-                tile2 = ( ((x + tw) // tw ) * tw , y)
-                tile1_rect = pg.Rect(tile1, (tw, tw))
-                tile2_rect = pg.Rect(tile2, (tw, tw))
-                blockers.extend([tile1_rect, tile2_rect])
-            else:
-                tile1 = ( x, (y // tw) * tw )
-                tile2 = ( x, ((y + tw) // tw ) * tw)
-                tile1_rect = pg.Rect(tile1, (tw, tw))
-                tile2_rect = pg.Rect(tile2, (tw, tw))
-                blockers.extend([tile1_rect, tile2_rect])
 
-        return blockers
+
+Sprite.create_action_table()
 
 
 class Player(Sprite):
@@ -213,15 +174,15 @@ class Player(Sprite):
             self.speed = 1
     
     def check_for_input(self, keys):
-        if self.action == 'resting':
+        if self.action == c.RESTING:
             if keys[pg.K_UP] or keys[pg.K_w]:
-                self.begin_moving('up')
+                self.begin_moving(c.UP)
             elif keys[pg.K_DOWN] or keys[pg.K_s]:
-                self.begin_moving('down')
+                self.begin_moving(c.DOWN)
             elif keys[pg.K_LEFT] or keys[pg.K_a]:
-                self.begin_moving('left')
+                self.begin_moving(c.LEFT)
             elif keys[pg.K_RIGHT] or keys[pg.K_d]:
-                self.begin_moving('right')
+                self.begin_moving(c.RIGHT)
     
     def do_step(self):
         if self.right:
@@ -233,23 +194,25 @@ class Player(Sprite):
 
 
 class Wanderer(Sprite):
+    moves = (c.UP, c.DOWN, c.LEFT, c.RIGHT)
+    
     def __init__(self, name, x, y, direction):
         super().__init__(name, x, y, direction)
         self.speed = 0.5
-        self.moves = ['up', 'down', 'left', 'right']
     
     def update(self, dt):
-        if self.action == 'resting':
+        if self.action == c.RESTING:
             self.begin_moving(self.moves[random.randint(0, 3)])
         super().update(dt)
 
 
 class Mover(Sprite):
+    moves = (c.RIGHT, c.RIGHT, c.RIGHT, c.DOWN, c.DOWN,
+             c.LEFT, c.LEFT, c.LEFT, c.UP, c.UP)
+    
     def __init__(self, name, x, y):
         super().__init__(name, x, y)
         self.speed = 0.5
-        self.moves = ['right', 'right', 'right', 'down', 'down',
-                      'left', 'left', 'left', 'up', 'up']
         self.index = 0
         
     def auto_moving(self):
@@ -259,20 +222,19 @@ class Mover(Sprite):
         self.index += 1
     
     def update(self, dt):
-        if self.action == 'resting':
+        if self.action == c.RESTING:
             self.auto_moving()
         super().update(dt)
 
 
 class Chicken(Sprite):
+    moves = (c.UP, c.DOWN, c.LEFT, c.RIGHT)
+    
     def __init__(self, x, y, direction, tiled_id=None, color='chicken'):
         super().__init__(color + '_move', x, y, direction)
         self.tiled_id = tiled_id
         self.speed = 0.5
-        self.moves = ['up', 'down', 'left', 'right']
-        self.rest_sheet_dict = self.create_spritesheet_dict(color + '_rest')
-        self.rest_animation_dict = self.create_animation_dict(
-            self.rest_sheet_dict)
+        self.rest_animations = self.create_animations(color + '_rest')
         self.rested = False
         self.rest_counter = 0
         self.color = color
@@ -282,7 +244,7 @@ class Chicken(Sprite):
 
     def resting(self):
         super().resting()
-        self.image_list = self.rest_animation_dict[self.direction]
+        self.image_list = self.rest_animations[self.direction]
         
         if self.rest_counter > 63:
             self.rest_counter = 0
@@ -293,7 +255,7 @@ class Chicken(Sprite):
         
     def update(self, dt):
         # Probability of moving is 1/125 i.e. 48% per second with 60 FPS.
-        if (self.action == 'resting' and random.random() < 0.008
+        if (self.action == c.RESTING and random.random() < 0.008
             and self.rested):
             self.auto_moving()
             self.rested = False
@@ -315,18 +277,8 @@ class MapObject(pg.sprite.Sprite):
         self.counter = random.randint(0, self.animation_speed)
         
     def create_image_list(self, sheet_key, frames, frame_width, frame_height):
-        image_list = []
-        sheet = GFX[sheet_key]
-        fw = frame_width
-        fh = frame_height
-        
-        for i in range(frames):
-            image = pg.Surface([fw, fh])
-            image.blit(sheet, (0, 0), (i*fw, 0, fw, fh))
-            image.set_colorkey((0, 0, 0))
-            image_list.append(image)
-        
-        return image_list
+        return FRAMES.get_frames(sheet_key, (frame_width, frame_height), 
+                                 ('strip', frames), (0, 0, 0))
     
     def update(self):
         if self.counter > self.animation_speed - 1:
@@ -364,11 +316,13 @@ class TextBox(pg.sprite.Sprite):
         self.lines = []
         self.active = False
         self.show = False
+        self.version = 0 # Increased every time image is redrawn.
     
     def give_text(self, text):
         lines_generator = self.get_lines(text, self.line_length)
         self.lines = [line for line in lines_generator]
         self.lines.extend([" ", " "])
+        self.changed = True
     
     def update(self, events):
         if self.active:
@@ -377,11 +331,16 @@ class TextBox(pg.sprite.Sprite):
             
             self.scroll_text_box(events, n)
             
+            if not self.changed:
+                return
+            
             for i in range(lines_in_box):
                 line = self.font.render(
                     self.lines[i + self.index], True, c.BROWN)
                 self.image.blit(
                     line, (c.TILE_WIDTH + 3, (i + 1)*c.TILE_WIDTH + 2))
+            self.changed = False
+            self.version += 1
     
     def scroll_text_box(self, events, n_lines):
         for event in events:
@@ -408,6 +367,7 @@ class TextBox(pg.sprite.Sprite):
     def clear(self):
         self.image.blit(GFX['text_box'], (0, 0))
         self.image.set_colorkey(c.WHITE)
+        self.changed = True
     
     def get_lines(self, text, line_length):
         start = 0
@@ -420,15 +380,16 @@ class TextBox(pg.sprite.Sprite):
     
 
 class Boat(Sprite):
+    moves = (c.RIGHT, c.RIGHT, c.RIGHT, c.DOWN, c.DOWN,
+             c.LEFT, c.LEFT, c.LEFT, c.UP, c.UP)
+    
     def __init__(self, sheet_key, x, y, direction):
         super().__init__(sheet_key, x, y, direction)
-        self.moves = ['right', 'right', 'right', 'down', 'down',
-                      'left', 'left', 'left', 'up', 'up']
         self.index = 0
         self.speed = 0.5
     
-    def create_spritesheet_dict(self, sheet_key, tw=32):
-        return super().create_spritesheet_dict(sheet_key, tw=tw)
+    def create_animations(self, sheet_key=None, tw=32):
+        return super().create_animations(sheet_key, tw=tw)
     
     def auto_moving(self):
         if self.index > 9:
@@ -437,7 +398,7 @@ class Boat(Sprite):
         self.index += 1
     
     def update(self, dt):
-        if self.action == 'resting':
+        if self.action == c.RESTING:
             self.auto_moving()
         super().update(dt)
 
@@ -2,15 +2,24 @@ import pygame as pg
 
 import constants as c
 import sprites as s
-from tools import State, Camera, Portal, Dialogue
-from setup import update_display, play_sfx, TMX, GFX, FONTS, MUSIC
-from tmx_renderer import Renderer
+from tools import (State, Camera, Portal, Dialogue, OccupancyGrid, SpatialHash,
+                   DirtyTracker, TriggerIndex, EventBus, ENTER, merge_rects)
+from crowd import make_crowd
+from tmx_renderer import ScrollingBackground
+from setup import (update_display, play_sfx, TMX, GFX, FONTS, MUSIC, MAP_CACHE,
+                   SAVES)
 
 class MapState(State):
     """
     Main playing state. Handles creation of map, sprites and objects from
     tmx data, manages their interactions and draws & updates game window.
     """
+    # Item name (type for hidden items): sound, volume, inventory counter.
+    item_effects = {'coin': ('coin', c.SFX_DEFAULT_VOLUME, 'gold'),
+                    'heart': ('heartbeat', 1.0, 'hearts'),
+                    'monster1': ('monster1', 1.0, None),
+                    'monster2': ('monster2', 1.0, None)}
+    
     def __init__(self, name):
         super().__init__()
         self.name = name
@@ -21,51 +30,119 @@ class MapState(State):
         self.music = None
         self.volume = None
     
-    def start_up(self, game_data):
+    def start_up_steps(self, game_data):
+        """
+        Loads the map and creates everything on it in steps, so that loading 
+        can be spread over the frames of the previous state's fade out. 
+        Game data is changed only after ENTER, when the previous state is 
+        done.
+        """
         self.game_data = game_data
         self.state = 'transition_in'
         self.map_state = self.make_map_state_dict()
-        self.game_data['current_map'] = self.name
         self.music, self.volume = self.set_music()
         self.transition_alpha = 255
         self.fade_speed = 2
         
         self.show_inventory = True
         self.inventory = self.game_data['player_data']
+        # Position of a loaded game, used instead of a start point.
+        self.spawn = self.game_data.pop('spawn', None)
         
-        self.tmx_renderer = Renderer(self.tmx_map)
-        self.map_image = self.tmx_renderer.render_map()
-        self.map_rect = self.map_image.get_rect()
+        # Parse (or pick up from map cache).
+        self.tmx_renderer = yield from MAP_CACHE.get_steps(self.name)
+        self.map_rect = pg.Rect(0, 0, self.tmx_renderer.map_width, 
+                                self.tmx_renderer.map_height)
+        yield
+        
+        # Headless runs draw nothing, so there is no view to prepare.
+        if not c.HEADLESS:
+            yield from self.prepare_view_steps()
         
         self.camera = Camera(self.map_rect.width, self.map_rect.height)
+        self.background = ScrollingBackground(self.tmx_renderer)
+        self.dirty = DirtyTracker()
         self.text_box = s.TextBox()
+        self.events = EventBus()
+        self.blockers = self.make_blockers()
+        yield
+        self.portals = self.make_portals()
+        self.map_objects = self.make_map_objects()
+        # Load maps reachable through portals in the background.
+        MAP_CACHE.prefetch([portal.name for portal in self.portals])
+        yield ENTER
         
+        # Sprites, items and dialogues depend on the quests opened here.
+        self.game_data['current_map'] = self.name
         self.quests = self.open_active_quests()
         
         self.player = self.make_player()
         self.sprites = self.make_sprites()
-        self.blockers = self.make_blockers()
-        self.portals = self.make_portals()
-        self.map_objects = self.make_map_objects()
+        self.occupancy = self.make_occupancy_grid([self.player, *self.sprites])
+        self.crowd = make_crowd(self.sprites, self.occupancy)
         self.map_items = self.make_map_items()
+        self.drawables = self.make_drawables()
         self.dialogues = self.make_dialogues()
-        
-    def make_player(self):
+        self.triggers = self.make_triggers()
+        self.player_span = None # Tiles player was on when triggers were checked.
+        self.dialogue = None # Dialogue player is on.
+        self.events.emit('map_entered', name=self.name)
+    
+    def prepare_view_steps(self):
+        """
+        Loads tile images of the map and renders chunks of the first view 
+        in steps.
+        """
+        # Tile images.
+        tmx_data = self.tmx_renderer.tmx_data
+        images = tmx_data.images
+        for i, gid in enumerate(tmx_data.visible_gids(), 1):
+            images[gid]
+            if i % 16 == 0:
+                yield
+        
+        # Map chunks of the first view.
+        x, y, direction = self.get_player_position()
+        for cx, cy in self.tmx_renderer.view_chunks((x, y)):
+            self.tmx_renderer.get_chunk(cx, cy)
+            yield
+    
+    def get_start_point(self):
+        """
+        Returns start point object named after the state player comes from.
+        """
         layer = self.tmx_renderer.get_layer('start_points')
         
         for obj in layer:
             if obj.name == self.previous:
-                player = s.Player(obj.x, obj.y, obj.properties['direction'])
-                return player
+                return obj
+    
+    def get_player_position(self):
+        """
+        Returns x, y and direction of player at start: position of a loaded 
+        game or the start point.
+        """
+        if self.spawn is not None:
+            return self.spawn
+        
+        obj = self.get_start_point()
+        return obj.x, obj.y, c.DIRECTIONS[obj.properties['direction']]
+        
+    def make_player(self):
+        x, y, direction = self.get_player_position()
+        player = s.Player(x, y, direction)
+        return player
     
     def make_sprites(self):
         sprites = pg.sprite.Group()
         layer = self.tmx_renderer.get_layer('sprites')
         
         for obj in layer:
+            # Direction property is a string in tmx.
+            direction = c.DIRECTIONS.get(obj.properties.get('direction'))
+            
             if obj.name == "wanderer":
-                sprite = s.Wanderer(
-                    'player_f', obj.x, obj.y, obj.properties['direction'])
+                sprite = s.Wanderer('player_f', obj.x, obj.y, direction)
                 sprites.add(sprite)
             
             if obj.name == 'mover':
@@ -75,18 +152,17 @@ class MapState(State):
             if obj.name == 'chicken':
                 if self.inventory['chickens']['catch']:
                     if obj.id not in self.inventory['catched_chickens']:
-                        sprite = s.Chicken(
-                            obj.x, obj.y, obj.properties['direction'], obj.id)
+                        sprite = s.Chicken(obj.x, obj.y, direction, obj.id)
                         sprites.add(sprite)
                 else:
-                    sprite = s.Chicken(obj.x, obj.y, obj.properties['direction'])
+                    sprite = s.Chicken(obj.x, obj.y, direction)
                     sprites.add(sprite)
             
             if obj.name == 'chicken_lost':
                 if self.inventory['chickens']['rescue']:
                     if obj.id not in self.inventory['found_items']:
                         sprite = s.Chicken(
-                            obj.x, obj.y, obj.properties['direction'], 
+                            obj.x, obj.y, direction, 
                                           obj.id,
                                           obj.properties['color'])
                         sprites.add(sprite)
@@ -101,7 +177,7 @@ class MapState(State):
                     sprites.add(sprite)
                 if obj.name == 'chicken_rgb':
                     sprite = s.Chicken(obj.x, obj.y, 
-                                       obj.properties['direction'], 
+                                       direction, 
                                        obj.id,
                                        obj.properties['color'])
                     sprites.add(sprite)
@@ -111,20 +187,59 @@ class MapState(State):
                     sprites.add(sprite)
             
             if obj.name == 'boat_player':
-                sprite = s.Boat(obj.name, obj.x, obj.y, 'right')
+                sprite = s.Boat(obj.name, obj.x, obj.y, c.RIGHT)
                 sprites.add(sprite)
         
         return sprites
     
     def make_blockers(self):
+        """
+        Returns rects of the blockers layer. Objects block the area of their 
+        size and touching blockers are merged to larger rects.
+        """
         blockers = []
         layer = self.tmx_renderer.get_layer('blockers')
         
         for obj in layer:
-            blocker = pg.Rect(obj.x, obj.y, c.TILE_WIDTH, c.TILE_WIDTH)
+            blocker = pg.Rect(obj.x, obj.y, obj.width or c.TILE_WIDTH, 
+                              obj.height or c.TILE_WIDTH)
             blockers.append(blocker)
         
-        return blockers
+        return merge_rects(blockers)
+    
+    def make_drawables(self):
+        """
+        Registers everything drawn on the map to a spatial hash, so that 
+        only the ones in view are drawn.
+        """
+        drawables = SpatialHash()
+        
+        for obj in self.map_objects:
+            drawables.add(obj, 0)
+        
+        for item in self.map_items:
+            if item.name != 'hidden':
+                drawables.add(item, 1)
+        
+        drawables.add(self.player, 2)
+        self.player.spatial_hash = drawables
+        
+        for sprite in self.sprites:
+            drawables.add(sprite, 3)
+            sprite.spatial_hash = drawables
+        
+        return drawables
+    
+    def make_occupancy_grid(self, sprites):
+        tw = c.TILE_WIDTH
+        grid = OccupancyGrid(self.map_rect.width // tw, self.map_rect.height // tw)
+        
+        for blocker in self.blockers:
+            grid.add_blocker(blocker)
+        for sprite in sprites:
+            grid.add(sprite)
+        
+        return grid
     
     def make_map_objects(self):
         map_objects = pg.sprite.Group()
@@ -182,56 +297,71 @@ class MapState(State):
         
         return dialogues
     
-    def check_for_portals(self):
+    def make_triggers(self):
+        triggers = TriggerIndex()
+        
         for portal in self.portals:
-            if self.player.rect.colliderect(portal.rect):
-                self.next = portal.name
-                self.state = 'transition_out'
-                if portal.sound == 'door':
-                    play_sfx('door')
+            triggers.add('portal', portal)
+        for item in self.map_items:
+            triggers.add('item', item)
+        for dialogue in self.dialogues:
+            triggers.add('dialogue', dialogue)
+        
+        return triggers
+    
+    def check_for_triggers(self):
+        """
+        Checks portals, items and dialogues when player has moved on new 
+        tiles. Standing still costs only comparing the tiles.
+        """
+        span = self.triggers.span(self.player.rect)
+        if span != self.player_span:
+            self.player_span = span
+            found = self.triggers.query(span)
+            self.check_for_items(found.get('item', ()))
+            dialogues = found.get('dialogue')
+            self.dialogue = dialogues[0] if dialogues else None
+            self.check_for_portals(found.get('portal', ()))
+        
+        self.check_for_dialogue()
     
-    def check_for_items(self):
+    def check_for_portals(self, portals):
+        for portal in portals:
+            self.next = portal.name
+            self.preload_next = True
+            self.state = 'transition_out'
+            if portal.sound == 'door':
+                play_sfx('door')
+    
+    def check_for_items(self, items):
         found_items = self.inventory['found_items']
         
-        for item in self.map_items:
-            if self.player.rect.colliderect(item.rect):
-                if item.name == 'coin':
-                    play_sfx('coin')
-                    found_items.add(item.tiled_id)
-                    self.inventory['gold'] += 1
-                    item.kill()
-                if item.name == 'hidden':
-                    if item.obj_type == 'monster1':
-                        play_sfx('monster1', 1.0)
-                        found_items.add(item.tiled_id)
-                        item.kill()
-                    if item.obj_type == 'monster2':
-                        play_sfx('monster2', 1.0)
-                        found_items.add(item.tiled_id)
-                        item.kill()
-                if item.name == 'heart':
-                    play_sfx('heartbeat', 1.0)
-                    found_items.add(item.tiled_id)
-                    self.inventory['hearts'] += 1
-                    item.kill()
-
-                    
+        for item in items:
+            name = item.obj_type if item.name == 'hidden' else item.name
+            effect = self.item_effects.get(name)
+            if effect is None:
+                continue
+            
+            sound, volume, counter = effect
+            play_sfx(sound, volume)
+            found_items.add(item.tiled_id)
+            if counter is not None:
+                self.inventory[counter] += 1
+            self.remove_item(item)
+            self.events.emit('item_found', name=name, tiled_id=item.tiled_id)
+    
     def check_for_dialogue(self):
-        collided = False
-        for dialogue in self.dialogues:
-            if self.player.rect.colliderect(dialogue.rect):
-                if not self.text_box.active:
-                    if self.check_if_quest_dialog(dialogue):
-                        pass
-                    else:
-                        self.text_box.give_text(dialogue.dict['normal'])
-                    self.text_box.active = True
-                
-                collided = True
-        
-        if not collided:
+        """
+        Gives text of the dialogue player is on to the text box, again after 
+        the box has been closed. Leaving the dialogue closes the box.
+        """
+        if self.dialogue is None:
             self.text_box.active = False
             self.text_box.show = False
+        elif not self.text_box.active:
+            if not self.check_if_quest_dialog(self.dialogue):
+                self.text_box.give_text(self.dialogue.dict['normal'])
+            self.text_box.active = True
     
     def check_if_quest_dialog(self, dialogue):
         for quest in self.quests:
@@ -253,70 +383,96 @@ class MapState(State):
         }
         return map_state_dict
     
-    def update(self, window, keys, dt, events):
+    def update(self, keys, dt, events):
         map_state_function = self.map_state[self.state]
-        map_state_function(window, keys, dt, events)
+        map_state_function(keys, dt, events)
     
-    def running_normally(self, window, keys, dt, events):
+    def draw(self, window, alpha):
+        self.update_window(window, alpha)
+    
+    def running_normally(self, keys, dt, events):
         self.player.update(keys, dt)
         self.sprites.update(dt)
+        if self.crowd is not None:
+            self.crowd.update(dt, self.camera.view_rect())
         self.map_objects.update()
         self.map_items.update()
-        self.text_box.update(events)
+        self.update_text_box(events)
         self.handle_collisions()
-        self.check_for_items()
         self.check_for_key_actions(keys)
-        self.check_for_dialogue()
-        self.check_for_portals()
-        self.check_quest_progress()
+        self.check_for_save(events)
+        self.check_for_triggers()
         self.camera.update(self.player.rect)
-        self.update_window(window)
     
-    def transition_in(self, window, keys, dt, events):
+    def update_text_box(self, events):
+        shown = self.text_box.show
+        self.text_box.update(events)
+        if shown and not self.text_box.show:
+            self.events.emit('dialogue_closed', dialogue=self.dialogue)
+    
+    def transition_in(self, keys, dt, events):
         self.fade = True
         image = pg.Surface(c.WINDOW_SIZE)
         image.fill(c.BLACK)
         image.set_alpha(self.transition_alpha)
         self.transition_image = image
         self.camera.update(self.player.rect)
-        self.update_window(window)
         self.transition_alpha -= int(round(self.fade_speed))
         self.fade_speed *= 1.1
         if self.transition_alpha <= 0:
             self.state = 'normal'
             self.transition_alpha = 0
             self.fade = False
+            # Last frame was drawn with the fade on.
+            self.dirty.invalidate()
 
-    def transition_out(self, window, keys, dt, events):
+    def transition_out(self, keys, dt, events):
         self.fade = True
         image = pg.Surface(c.WINDOW_SIZE)
         image.fill(c.BLACK)
         image.set_alpha(self.transition_alpha)
         self.transition_image = image
         self.camera.update(self.player.rect)
-        self.update_window(window)
         self.transition_alpha += int(self.fade_speed)
         self.fade_speed *= 0.9
         if self.transition_alpha >= 255:
             self.done = True
             self.transition_alpha = 255
-            self.fade = False
+            # Stays black until the next state is entered, also while it 
+            # is still loading.
+            image.set_alpha(255)
 
-    def update_window(self, window):
-        window.blit(self.map_image, self.camera.apply(self.map_rect))
-        
-        for obj in self.map_objects:
-            window.blit(obj.image, self.camera.apply(obj.rect))
+    def update_window(self, window, alpha=1.0):
+        """
+        Draws the map view. Sprites and camera are drawn between their 
+        previous and current tick positions by alpha.
+        """
+        x, y = self.camera.interpolate(alpha)
+        drawables = self.drawables.query(pg.Rect((-x, -y), c.WINDOW_SIZE))
+        if self.crowd is not None:
+            drawables.extend(self.crowd.visible)
+        
+        placed = []
+        for drawable in drawables:
+            if isinstance(drawable, s.Sprite):
+                dx, dy = drawable.interpolate(alpha)
+            else:
+                dx, dy = drawable.rect.topleft
+            placed.append((drawable, (dx + x, dy + y)))
         
-        for item in self.map_items:
-            if item.name == 'hidden':
-                continue
-            window.blit(item.image, self.camera.apply(item.rect))
+        rects = None
+        if c.DIRTY_RECTS:
+            if self.fade:
+                self.dirty.invalidate()
+            self.mark_overlays()
+            rects = self.find_dirty_rects(placed, (x, y))
+            if not rects:
+                return
         
-        window.blit(self.player.image, self.camera.apply(self.player.rect))
+        self.background.draw(window, (x, y))
         
-        for sprite in self.sprites:
-            window.blit(sprite.image, self.camera.apply(sprite.rect))
+        for drawable, position in placed:
+            window.blit(drawable.image, position)
         
         if self.show_inventory:
             self.draw_inventory(window)
@@ -327,45 +483,56 @@ class MapState(State):
         if self.fade:
             window.blit(self.transition_image, (0, 0))
         
-        update_display(window)
+        update_display(window, rects)
     
-    def handle_collisions(self):
-        player_collided = False
-        collided_sprites = []
-        all_sprite_blockers = []
+    def find_dirty_rects(self, placed, offset):
+        """
+        Returns the parts of the window that changed since the previous 
+        frame. placed is a list of (drawable, window position). 
+        Camera scrolling redraws the whole window.
+        """
+        dirty = self.dirty
+        dirty.scroll(offset)
         
-        for sprite in self.sprites:
-            
-            if self.inventory['chickens']['catchable']:
-                if self.chicken_catched(sprite):
-                    continue
-            
-            all_sprite_blockers.extend(sprite.blockers)
+        for drawable, (x, y) in placed:
+            dirty.mark(drawable, drawable.image, 
+                       (x, y, drawable.rect.width, drawable.rect.height))
         
-        for blocker in self.blockers:
-            if self.player.rect.colliderect(blocker):
-                player_collided = True
+        return dirty.get_rects()
+    
+    def mark_overlays(self):
+        """
+        Marks inventory and text box for dirty rect rendering.
+        """
+        dirty = self.dirty
         
-        for blocker in all_sprite_blockers:
-            if self.player.rect.colliderect(blocker):
-                player_collided = True
+        if self.show_inventory:
+            inventory = self.inventory
+            chickens = inventory['chickens']
+            dirty.mark('inventory', 
+                       (inventory['gold'], inventory['hearts'], chickens['show'],
+                        chickens['amount'], chickens['max']),
+                       (0, 0, 4 * c.TILE_WIDTH, 3 * c.TILE_WIDTH))
         
-        if player_collided:
-            self.player.begin_resting()
+        if self.text_box.show:
+            dirty.mark('text_box', self.text_box.version, self.text_box.rect)
+    
+    def handle_collisions(self):
+        """
+        Sprites are stopped by the occupancy grid when they try to move to a 
+        reserved or blocked tile. Bumps between player and other sprites are 
+        checked here for catching chickens.
+        """
+        bumps = self.occupancy.bumps
         
-        for sprite in self.sprites:
-            for blocker in self.blockers:
-                if sprite.rect.colliderect(blocker):
-                    collided_sprites.append(sprite)
-            if sprite.rect.colliderect(self.player.rect):
-                collided_sprites.append(sprite)
-            sprite.kill()
-            if pg.sprite.spritecollideany(sprite, self.sprites):
-                collided_sprites.append(sprite)
-            self.sprites.add(sprite)
-        
-        for sprite in collided_sprites:
-            sprite.begin_resting()
+        if self.inventory['chickens']['catchable']:
+            for mover, occupant in bumps:
+                if mover is self.player:
+                    self.chicken_catched(occupant)
+                elif occupant is self.player:
+                    self.chicken_catched(mover)
+        
+        bumps.clear()
     
     def draw_inventory(self, window):
         tw = c.TILE_WIDTH
@@ -398,6 +565,20 @@ class MapState(State):
         if keys[pg.K_q]:
             self.show_inventory = False
     
+    def check_for_save(self, events):
+        """
+        Saves game on F5. Player is saved on the nearest tile, as it may be 
+        between tiles.
+        """
+        for event in events:
+            if event.type == pg.KEYDOWN and event.key == pg.K_F5:
+                tw = c.TILE_WIDTH
+                x, y = self.player.rect.topleft
+                SAVES.save(self.game_data, (round(x / tw) * tw, 
+                                            round(y / tw) * tw, 
+                                            self.player.direction))
+                play_sfx('select', 0.5)
+    
     def set_music(self):
         """
         Set music based on states name.
@@ -420,39 +601,60 @@ class MapState(State):
         for quest in self.game_data['active_quests']:
             active_quest = self.game_data['quest_data'][quest]['class_name']
             active_quest.open(self.game_data)
+            active_quest.subscribe(self.events)
             quests.append(active_quest)
         
         return quests
     
-    def check_quest_progress(self):
-        for quest in self.quests:
-            if quest.active:
-                quest.update()
-    
     def clean_up(self):
         for quest in self.quests:
             if quest.name not in self.game_data['active_quests']:
                 quest.deactivate()
+        # Tilesets no other map uses are freed. The map stays in MAP_CACHE 
+        # and takes them back when entered again.
+        self.tmx_renderer.release()
         return State.clean_up(self)
     
     def chicken_catched(self, sprite):
+        """
+        Catches sprite if it is a catchable chicken. 
+        Called when player and sprite bump into each other.
+        """
+        # Crowd members are not in any group, so alive() can't tell if 
+        # sprite was already caught.
+        if sprite.occupancy is not self.occupancy:
+            return False
+        
         if (sprite.name == 'chicken_move' and self.inventory['chickens']['catch']
             and self.name == c.SANDY_COVE):
-            if self.player.rect.colliderect(sprite.rect):
-                play_sfx('chicken', 0.4)
-                self.inventory['catched_chickens'].add(sprite.tiled_id)
-                self.inventory['chickens']['amount'] += 1
-                sprite.kill()
-                return True
+            play_sfx('chicken', 0.4)
+            self.inventory['catched_chickens'].add(sprite.tiled_id)
+            self.inventory['chickens']['amount'] += 1
+            self.remove_sprite(sprite)
+            self.events.emit('chicken_caught', name=sprite.name, 
+                             tiled_id=sprite.tiled_id)
+            return True
         
         if (sprite.name == 'red_move' or 
             sprite.name == 'green_move' or sprite.name == 'blue_move'):
-            if self.player.rect.colliderect(sprite.rect):
-                play_sfx('chicken', 0.4)
-                self.inventory['found_items'].add(sprite.tiled_id)
-                self.inventory['chickens']['amount'] += 1
-                sprite.kill()
-                return True
+            play_sfx('chicken', 0.4)
+            self.inventory['found_items'].add(sprite.tiled_id)
+            self.inventory['chickens']['amount'] += 1
+            self.remove_sprite(sprite)
+            self.events.emit('chicken_caught', name=sprite.name, 
+                             tiled_id=sprite.tiled_id)
+            return True
         
         return False
     
+    def remove_sprite(self, sprite):
+        if self.crowd is not None:
+            self.crowd.remove(sprite)
+        self.occupancy.remove(sprite)
+        self.drawables.remove(sprite)
+        sprite.kill()
+    
+    def remove_item(self, item):
+        self.triggers.remove(item)
+        self.drawables.remove(item)
+        item.kill()
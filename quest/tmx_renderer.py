@@ -1,44 +1,251 @@
 import pygame as pg
+from collections import OrderedDict
 
 import pytmx
+import constants as c
 
 class Renderer:
     """
     Renders tile map made in Tiled to pygame surface using pytmx library.
+    
+    Map can be drawn in fixed size chunks that are rendered when they first 
+    come into view and kept in a LRU cache of max_chunks chunks, so memory 
+    use depends on the view size instead of the map size.
+    
+    With load_images=False the map is only parsed and its tileset images 
+    decoded, and load_images has to be called before drawing. Neither 
+    touches the display, so it can be done on a background thread.
     """
-    def __init__(self, filename):
-        tm = pytmx.load_pygame(filename)
+    def __init__(self, filename, chunk_size=c.CHUNK_SIZE, 
+                 max_chunks=c.MAX_CHUNKS, load_images=True):
+        tm = pytmx.load_pygame(filename, cache_dir=c.TMX_CACHE_DIR, 
+                               defer_images=not load_images)
+        # Headless runs never draw, so there is nothing to decode.
+        if not load_images and not c.HEADLESS:
+            tm.decode_images()
+        self.images_loaded = load_images
         self.map_width = tm.width * tm.tilewidth
         self.map_height = tm.height * tm.tileheight
         self.tmx_data = tm
+        
+        self.chunk_size = chunk_size
+        self.max_chunks = max_chunks
+        self.chunks = OrderedDict()
+        self.tile_layers = [layer for layer in tm.visible_layers 
+                            if isinstance(layer, pytmx.TiledTileLayer)]
     
-    def render_map(self):
-        surface = pg.Surface((self.map_width, self.map_height))
+    def load_images(self):
+        """
+        Sets up tile images of a map parsed with load_images=False. Must be 
+        called on the main thread. Tiles are still loaded lazily.
+        """
+        if not self.images_loaded:
+            self.tmx_data.reload_images()
+            self.images_loaded = True
+    
+    def draw(self, surface, offset):
+        """
+        Blits the chunks that are visible on surface when map is drawn 
+        at offset (camera position).
+        """
+        cs = self.chunk_size
+        ox, oy = offset
+        surface_blit = surface.blit
         
-        if self.tmx_data.background_color:
-            surface.fill(pg.Color(self.tmx_data.background_color))
+        for cx, cy in self.visible_chunks(offset, surface.get_size()):
+            surface_blit(self.get_chunk(cx, cy), (cx * cs + ox, cy * cs + oy))
+    
+    def draw_area(self, surface, offset, area):
+        """
+        Blits the part of the map inside area (a rect on surface) when map 
+        is drawn at offset. Parts of area outside the map are filled black.
+        """
+        cs = self.chunk_size
+        ox, oy = offset
+        surface_blit = surface.blit
+        clip = surface.get_clip()
+        surface.set_clip(area)
+        surface.fill(c.BLACK, area)
         
-        for layer in self.tmx_data.visible_layers:
-            if isinstance(layer, pytmx.TiledTileLayer):
-                self.render_tile_layer(surface, layer)
+        for cx, cy in self.visible_chunks((ox - area.x, oy - area.y), 
+                                          area.size):
+            surface_blit(self.get_chunk(cx, cy), (cx * cs + ox, cy * cs + oy))
         
-        return surface
+        surface.set_clip(clip)
     
-    def render_tile_layer(self, surface, layer):
-        """ 
-        Renders all TiledTiles in this layer.
+    def visible_chunks(self, offset, size):
+        """
+        Returns list of chunk coordinates visible in a view of size 
+        when map is drawn at offset.
         """
+        cs = self.chunk_size
+        ox, oy = offset
+        width, height = size
+        left = max(0, -ox) // cs
+        top = max(0, -oy) // cs
+        right = min(self.map_width - 1, width - ox - 1) // cs
+        bottom = min(self.map_height - 1, height - oy - 1) // cs
+        
+        return [(cx, cy) for cy in range(top, bottom + 1) 
+                for cx in range(left, right + 1)]
+    
+    def view_chunks(self, center, size=c.WINDOW_SIZE):
+        """
+        Returns list of chunk coordinates of a view of size centered on 
+        map position center (clamped to map edges like the camera does).
+        """
+        x = max(0, min(int(center[0]) - size[0] // 2, 
+                       self.map_width - size[0]))
+        y = max(0, min(int(center[1]) - size[1] // 2, 
+                       self.map_height - size[1]))
+        return self.visible_chunks((-x, -y), size)
+    
+    def get_chunk(self, cx, cy):
+        """
+        Returns pre-rendered chunk at chunk coordinates cx, cy.
+        Renders it first if needed and drops least recently used chunks.
+        """
+        key = (cx, cy)
+        chunk = self.chunks.get(key)
+        
+        if chunk is None:
+            chunk = self.render_chunk(cx, cy)
+            self.chunks[key] = chunk
+            while len(self.chunks) > self.max_chunks:
+                self.chunks.popitem(last=False)
+        else:
+            self.chunks.move_to_end(key)
+        
+        return chunk
+    
+    def render_chunk(self, cx, cy):
+        """
+        Renders tiles of all visible tile layers inside one chunk.
+        """
+        tm = self.tmx_data
+        tw = tm.tilewidth
+        th = tm.tileheight
+        cs = self.chunk_size
+        
+        x = cx * cs
+        y = cy * cs
+        width = min(cs, self.map_width - x)
+        height = min(cs, self.map_height - y)
+        chunk = pg.Surface((width, height))
+        
+        if tm.background_color:
+            chunk.fill(pg.Color(tm.background_color))
+        
+        # Tile range covered by the chunk.
+        tx0, ty0 = x // tw, y // th
+        tx1 = min(tm.width, -(-(x + width) // tw))
+        ty1 = min(tm.height, -(-(y + height) // th))
+        
         # Dereference these heavily used references for speed.
-        tw = self.tmx_data.tilewidth
-        th = self.tmx_data.tileheight
-        surface_blit = surface.blit
+        images = tm.images
+        chunk_blit = chunk.blit
         
-        # Iterate over the tiles in the layer, and blit them.
-        for x, y, image in layer.tiles():
-            surface_blit(image, (x * tw, y * th))
+        for layer in self.tile_layers:
+            for ty in range(ty0, ty1):
+                row = layer.data[ty]
+                py = ty * th - y
+                for tx in range(tx0, tx1):
+                    gid = row[tx]
+                    if gid:
+                        chunk_blit(images[gid], (tx * tw - x, py))
+        
+        return chunk
     
     def get_layer(self, layer_name):
         layer = self.tmx_data.get_layer_by_name(layer_name)
         return layer
     
-    
\ No newline at end of file
+    def memory_usage(self):
+        """
+        Returns approximate number of bytes held by rendered chunks, loaded 
+        and decoded tile images and tile layer data of this map. Tile images 
+        of shared tilesets are counted for every map using them.
+        """
+        chunk_bytes = sum(chunk.get_width() * chunk.get_height() * 
+                          chunk.get_bytesize() 
+                          for chunk in self.chunks.values())
+        images = {id(image): image for image, mask in 
+                  list(self.tmx_data.decoded_images.values())}
+        if self.images_loaded:
+            images.update((id(image), image) 
+                          for image in self.tmx_data.images.loaded())
+        image_bytes = sum(image.get_width() * image.get_height() * 
+                          image.get_bytesize() 
+                          for image in images.values())
+        layer_bytes = sum(len(layer.data) * layer.width * 2 
+                          for layer in self.tile_layers)
+        return chunk_bytes + image_bytes + layer_bytes
+    
+    def acquire(self):
+        """
+        Takes back the shared tilesets after release.
+        """
+        self.tmx_data.acquire_tilesets()
+    
+    def release(self):
+        """
+        Releases the tilesets shared with other maps.
+        """
+        self.tmx_data.release()
+    
+    
+
+class ScrollingBackground:
+    """
+    Keeps the map background of the previous frame. When the camera moves, 
+    the old background is shifted in place and only the edge strips that 
+    came into view are drawn from the map, so the cost of a frame depends 
+    on the scroll speed instead of the view size.
+    """
+    def __init__(self, renderer, size=c.WINDOW_SIZE):
+        self.renderer = renderer
+        self.surface = pg.Surface(size)
+        self.offset = None
+    
+    def draw(self, surface, offset):
+        """
+        Updates background for map drawn at offset and blits it on surface.
+        """
+        self.update(offset)
+        surface.blit(self.surface, (0, 0))
+    
+    def update(self, offset):
+        background = self.surface
+        width, height = background.get_size()
+        
+        if self.offset is None:
+            self.renderer.draw_area(background, offset, background.get_rect())
+            self.offset = offset
+            return
+        
+        dx = offset[0] - self.offset[0]
+        dy = offset[1] - self.offset[1]
+        if dx == 0 and dy == 0:
+            return
+        
+        self.offset = offset
+        if abs(dx) >= width or abs(dy) >= height:
+            self.renderer.draw_area(background, offset, background.get_rect())
+            return
+        
+        background.scroll(dx, dy)
+        if dx > 0:
+            self.renderer.draw_area(background, offset, 
+                                    pg.Rect(0, 0, dx, height))
+        elif dx < 0:
+            self.renderer.draw_area(background, offset, 
+                                    pg.Rect(width + dx, 0, -dx, height))
+        if dy > 0:
+            self.renderer.draw_area(background, offset, 
+                                    pg.Rect(0, 0, width, dy))
+        elif dy < 0:
+            self.renderer.draw_area(background, offset, 
+                                    pg.Rect(0, height + dy, width, -dy))
+    
+    def invalidate(self):
+        self.offset = None
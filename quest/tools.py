@@ -1,7 +1,9 @@
 import pygame as pg
 import os
+import time
 
 import constants as c
+from pytmx.util_pygame import simplify
 
 class GameStatesManager:
     """
@@ -11,6 +13,7 @@ class GameStatesManager:
         self.state_dict = {}
         self.state_name = None
         self.state = None
+        self.incoming = None
     
     def setup(self, state_dict, start_state):
         """
@@ -22,27 +25,54 @@ class GameStatesManager:
         self.state = self.state_dict[self.state_name]
         self.set_music()
     
-    def update(self, window, keys, dt, events):
+    def update(self, keys, dt, events):
         """
-        Checks if a state is done. Changes state if necessary 
-        and state.update is called.
+        Runs one simulation tick. Checks if a state is done. Changes state 
+        if necessary and state.update is called.
+        
+        When a state knows its next state before it is done (e.g. it is 
+        fading out), next state is loaded in steps within c.LOAD_BUDGET 
+        per tick and state is changed only after loading is ready. Steps 
+        changing game data are left to flip_state (see ENTER).
         """
-        if self.state.done:
+        if self.state.preload_next and self.incoming is None:
+            self.prepare_next_state()
+        if self.incoming is not None and not self.incoming.ready:
+            self.incoming.continue_loading(c.LOAD_BUDGET)
+        if self.state.done and (self.incoming is None or self.incoming.ready):
             self.flip_state()
-        self.state.update(window, keys, dt, events)
+        self.state.update(keys, dt, events)
+    
+    def draw(self, window, alpha=1.0):
+        """
+        Renders current state. alpha is the fraction of the next tick 
+        already passed, used for interpolating movement.
+        """
+        self.state.draw(window, alpha)
+    
+    def prepare_next_state(self):
+        """
+        Begins loading of the next state, passing on game data. Exiting 
+        state keeps running until it is done.
+        """
+        self.incoming = self.state_dict[self.state.next]
+        self.incoming.previous = self.state_name
+        self.incoming.previous_music = self.state.music_title
+        self.incoming.begin_loading(self.state.game_data)
         
     def flip_state(self):
         """
-        Changes to a new state and performs clean_up for exiting state 
-        and start_up for new state. (Most importantly passing on game data.)
+        Performs clean_up for exiting state and changes to the next state, 
+        finishing its loading if it was not prepared in advance.
         """
-        previous, self.state_name = self.state_name, self.state.next
-        previous_music = self.state.music_title
-        game_data = self.state.clean_up()
-        self.state = self.state_dict[self.state_name]
-        self.state.previous = previous
-        self.state.previous_music = previous_music
-        self.state.start_up(game_data)
+        if self.incoming is None:
+            self.prepare_next_state()
+        self.state.clean_up()
+        self.incoming.finish_loading()
+        self.state.done = False
+        self.state_name = self.state.next
+        self.state = self.incoming
+        self.incoming = None
         self.set_music()
     
     def set_music(self):
@@ -51,11 +81,15 @@ class GameStatesManager:
         """
         if self.state.music_title == self.state.previous_music:
             pass
-        elif self.state.music:
+        elif self.state.music and pg.mixer.get_init():
             pg.mixer.music.load(self.state.music)
             pg.mixer.music.set_volume(self.state.volume)
             pg.mixer.music.play(-1)
         
+# Yielded by start up steps: steps before it only load, steps after it 
+# change game data and run when the state is entered.
+ENTER = object()
+
 class State:
     """
     Template class for all game states to inherit from.
@@ -65,17 +99,80 @@ class State:
         self.game_data = None
         self.next = None
         self.previous = 'start'
+        self.preload_next = False
+        self.ready = False
+        self.loader = None
+        self.step_time = 0.0 # Time the last start up step took.
     
     def start_up(self, game_data):
+        self.begin_loading(game_data)
+        self.finish_loading()
+    
+    def start_up_steps(self, game_data):
+        """
+        Generator performing start up in resumable steps. 
+        Children override this instead of start_up.
+        """
         self.game_data = game_data
+        yield
+    
+    def begin_loading(self, game_data):
+        self.ready = False
+        self.step_time = 0.0
+        self.loader = self.start_up_steps(game_data)
+    
+    def continue_loading(self, budget):
+        """
+        Runs start up steps until budget (seconds) is used up. A step is 
+        not started if it would run over the budget, going by how long the 
+        previous step took, but at least one step is run per call. 
+        Returns True when all steps up to ENTER are done.
+        """
+        now = time.perf_counter()
+        deadline = now + budget
+        first = True
+        while not self.ready:
+            if not first and now + self.step_time > deadline:
+                break
+            first = False
+            start = now
+            try:
+                step = next(self.loader)
+            except StopIteration:
+                self.ready = True
+                self.loader = None
+                break
+            if step is ENTER:
+                self.ready = True
+            now = time.perf_counter()
+            self.step_time = now - start
+        return self.ready
+    
+    def finish_loading(self):
+        """
+        Runs all remaining start up steps, including those after ENTER.
+        """
+        while self.loader is not None:
+            try:
+                next(self.loader)
+            except StopIteration:
+                self.loader = None
+        self.ready = True
     
     def clean_up(self):
         self.done = False
+        self.preload_next = False
         return self.game_data
     
-    def update(self, window, keys, dt, events):
+    def update(self, keys, dt, events):
+        """
+        Simulation tick of state. Must be overrided in children.
+        """
+        pass
+    
+    def draw(self, window, alpha):
         """
-        Update method for state. Must be overrided in children.
+        Renders state to window and shows it. Must be overrided in children.
         """
         pass
     
@@ -126,6 +223,14 @@ def create_game_data_dict():
                       }
     return game_data_dict
 
+def interpolate(previous, current, alpha):
+    """
+    Returns position between previous and current. alpha is from 0 to 1.
+    """
+    px, py = previous
+    x, y = current
+    return (px + int(round((x - px) * alpha)), py + int(round((y - py) * alpha)))
+
 def load_all_gfx(directory, colorkey=c.WHITE, accept=('.png', '.jpg', '.bmp')):
     graphics = {}
     for pic in os.listdir(directory):
@@ -163,24 +268,120 @@ def load_all_sfx(directory, accept=('.wav','.ogg',)):
     return effects
 
 
+class FrameCache:
+    """
+    Process wide cache of animation frames cut from the sprite sheets in gfx. 
+    Frames are keyed by (sheet_key, frame size, layout, colorkey), so every 
+    sprite using the same sheet shares the same surfaces. Returned frame 
+    tuples and animation dicts are shared and must not be modified.
+    
+    Layouts:
+        'directions' - 4x4 sheet, rows are up, down, left and right, in 
+                       the order of direction codes in constants.
+        ('strip', n) - n frames in a single row.
+    """
+    def __init__(self, gfx):
+        self.gfx = gfx
+        self.frames = {}
+        self.animations = {}
+        self.hits = 0
+        self.misses = 0
+    
+    def get_frames(self, sheet_key, frame_size, layout, colorkey=c.WHITE):
+        """
+        Returns a tuple of frames cut from sheet in row-major order.
+        """
+        key = (sheet_key, tuple(frame_size), layout, colorkey)
+        frames = self.frames.get(key)
+        if frames is not None:
+            self.hits += 1
+            return frames
+        
+        self.misses += 1
+        fw, fh = frame_size
+        if layout == 'directions':
+            columns, rows = 4, 4
+        elif layout[0] == 'strip':
+            columns, rows = layout[1], 1
+        else:
+            raise ValueError('Unknown frame layout: {}'.format(layout))
+        
+        sheet = self.gfx[sheet_key]
+        frames = []
+        for row in range(rows):
+            for column in range(columns):
+                image = pg.Surface([fw, fh])
+                image.blit(sheet, (0, 0), (column*fw, row*fh, fw, fh))
+                image.set_colorkey(colorkey)
+                frames.append(image)
+        
+        frames = tuple(frames)
+        self.frames[key] = frames
+        return frames
+    
+    def get_animations(self, sheet_key, tw=c.TILE_WIDTH):
+        """
+        Returns a tuple of frame tuples, indexed by direction code, for a 
+        4x4 sheet.
+        """
+        key = (sheet_key, (tw, tw), 'directions', c.WHITE)
+        animations = self.animations.get(key)
+        if animations is None:
+            frames = self.get_frames(sheet_key, (tw, tw), 'directions')
+            animations = tuple(frames[i*4:i*4 + 4] for i in range(4))
+            self.animations[key] = animations
+        return animations
+    
+    def memory_usage(self):
+        """
+        Returns approximate amount of bytes held by cached frames.
+        """
+        return sum(frame.get_width() * frame.get_height() * frame.get_bytesize()
+                   for frames in self.frames.values() for frame in frames)
+    
+    def stats(self):
+        return {'sheets': len(self.frames),
+                'frames': sum(len(frames) for frames in self.frames.values()),
+                'bytes': self.memory_usage(),
+                'hits': self.hits,
+                'misses': self.misses}
+    
+    def report(self):
+        return ('sheets: {sheets} frames: {frames} hits: {hits} '
+                'misses: {misses} held: {kb} kB').format(
+                    kb=self.memory_usage() // 1024, **self.stats())
+    
+    def clear(self):
+        self.frames.clear()
+        self.animations.clear()
+
+
 class Camera:
     """
-    Class to handle world scrolling. Applying moves target rect position so 
-    that screen view is centered on source_rect.
+    Class to handle world scrolling. Camera position is the offset map is 
+    drawn at, so that screen view is centered on the followed rect.
     """
     def __init__(self, map_width, map_height):
         self.state = pg.Rect(0, 0, map_width, map_height)
+        self.previous_position = self.state.topleft
     
-    def apply(self, target_rect):
+    def interpolate(self, alpha):
         """
-        Offsets target rects position according to camera state.
+        Returns camera offset between the previous and the current tick.
         """
-        return target_rect.move(self.state.topleft)
+        return interpolate(self.previous_position, self.state.topleft, alpha)
+    
+    def view_rect(self):
+        """
+        Returns the part of the map currently on screen.
+        """
+        return pg.Rect((-self.state.x, -self.state.y), c.WINDOW_SIZE)
     
     def update(self, source_rect):
         """
         Updates camera to follow source_rect.
         """
+        self.previous_position = self.state.topleft
         x = - source_rect.center[0] + c.WINDOW_SIZE[0] // 2
         y = - source_rect.center[1] + c.WINDOW_SIZE[1] // 2
         position = pg.Vector2(self.state.topleft)
@@ -190,6 +391,505 @@ class Camera:
         self.state.y = max(-(self.state.height - c.WINDOW_SIZE[1]), min(0, self.state.y))
 
 
+class Presenter:
+    """
+    Presents the game window on the display, scaled to display size.
+    
+    Modes:
+        'scale_blit' - scale window to a display sized surface and blit it.
+        'scale'      - scale window straight into the display surface.
+        'scale2x'    - pg.transform.scale2x straight into the display 
+                       surface. Smooths edges, so it is only used when 
+                       asked for, and only if display is twice the window.
+        'scaled'     - display in pygame's SCALED mode at window size, 
+                       SDL does the scaling.
+    
+    With mode None the faster of 'scale_blit' and 'scale' is picked by 
+    timing their scaling on offscreen surfaces (results), and the display 
+    is set once. 'scaled' is left out, as SDL's scaling happens at flip 
+    and can not be timed offscreen. cost is the average time in seconds 
+    of the presents so far, flip included.
+    """
+    def __init__(self, window_size=c.WINDOW_SIZE, display_size=c.DISPLAY_SIZE, 
+                 mode=c.PRESENT_MODE):
+        self.window_size = window_size
+        self.display_size = display_size
+        self.window_rect = pg.Rect((0, 0), window_size)
+        self.display = None
+        self.surf_to_display = None
+        self.mode = None
+        self.results = {}
+        self.presents = 0
+        self.present_time = 0.0
+        
+        if mode is None:
+            mode = self.benchmark()
+        if mode == 'scale2x' and display_size != (2 * window_size[0], 
+                                                  2 * window_size[1]):
+            mode = 'scale'
+        try:
+            self.set_mode(mode)
+        except pg.error:
+            # SCALED is not supported by every video driver.
+            if mode != 'scaled':
+                raise
+            mode = 'scale'
+            self.set_mode(mode)
+    
+    @property
+    def cost(self):
+        if not self.presents:
+            return None
+        return self.present_time / self.presents
+    
+    def set_mode(self, mode):
+        if mode == 'scaled':
+            self.display = pg.display.set_mode(
+                self.window_size, pg.SCALED, vsync=int(c.VSYNC))
+        else:
+            self.display = pg.display.set_mode(self.display_size)
+        
+        if mode == 'scale_blit':
+            self.surf_to_display = pg.Surface(self.display_size)
+        else:
+            self.surf_to_display = None
+        self.mode = mode
+    
+    def benchmark(self, frames=c.PRESENT_BENCHMARK_FRAMES, repeats=3):
+        """
+        Times the scaling of 'scale_blit' and 'scale' and returns the 
+        faster mode. A display sized offscreen surface stands in for the 
+        display, so the display mode is not changed. Both flip a display 
+        of the same size, so flipping is left out. Modes take turns 
+        repeats times and the best time of each is kept.
+        """
+        window = pg.Surface(self.window_size)
+        window.fill(c.BLACK)
+        display = pg.Surface(self.display_size)
+        surf_to_display = pg.Surface(self.display_size)
+        
+        def scale_blit():
+            pg.transform.scale(window, self.display_size, surf_to_display)
+            display.blit(surf_to_display, (0, 0))
+        
+        def scale():
+            pg.transform.scale(window, self.display_size, display)
+        
+        presents = {'scale_blit': scale_blit, 'scale': scale}
+        for repeat in range(repeats):
+            for mode, present in presents.items():
+                present()
+                start = time.perf_counter()
+                for i in range(frames):
+                    present()
+                cost = (time.perf_counter() - start) / frames
+                self.results[mode] = min(cost, self.results.get(mode, cost))
+        
+        return min(self.results, key=self.results.get)
+    
+    def present(self, window, rects=None):
+        """
+        Shows window on the display. If rects (in window coordinates) are 
+        given, only those parts are updated.
+        """
+        start = time.perf_counter()
+        self.show(window, rects)
+        self.present_time += time.perf_counter() - start
+        self.presents += 1
+    
+    def show(self, window, rects):
+        mode = self.mode
+        display = self.display
+        
+        if rects is None:
+            if mode == 'scale_blit':
+                pg.transform.scale(window, self.display_size, 
+                                   self.surf_to_display)
+                display.blit(self.surf_to_display, (0, 0))
+            elif mode == 'scale':
+                pg.transform.scale(window, self.display_size, display)
+            elif mode == 'scale2x':
+                pg.transform.scale2x(window, display)
+            else:
+                display.blit(window, (0, 0))
+            pg.display.flip()
+            return
+        
+        (ww, wh), (dw, dh) = self.window_size, self.display_size
+        updated = []
+        for rect in rects:
+            rect = rect.clip(self.window_rect)
+            if not rect.width or not rect.height:
+                continue
+            
+            if mode == 'scaled':
+                display.blit(window, rect, rect)
+                updated.append(rect)
+                continue
+            
+            left, top = rect.left * dw // ww, rect.top * dh // wh
+            right, bottom = rect.right * dw // ww, rect.bottom * dh // wh
+            scaled = pg.Rect(left, top, right - left, bottom - top)
+            if mode == 'scale2x':
+                pg.transform.scale2x(window.subsurface(rect), 
+                                     display.subsurface(scaled))
+            else:
+                pg.transform.scale(window.subsurface(rect), scaled.size, 
+                                   display.subsurface(scaled))
+            updated.append(scaled)
+        pg.display.update(updated)
+    
+    def report(self):
+        report = 'present mode: {}'.format(self.mode)
+        if self.cost is not None:
+            report += ' cost: {:.2f} ms'.format(self.cost * 1000)
+        timings = ' '.join('{}: {:.2f} ms'.format(mode, cost * 1000) 
+                           for mode, cost in self.results.items())
+        return '{} {}'.format(report, timings).strip()
+
+
+class NullPresenter:
+    """
+    Presenter for headless runs. Nothing is shown, presents are counted.
+    """
+    mode = 'null'
+    cost = 0.0
+    
+    def __init__(self):
+        self.frames = 0
+        self.results = {}
+    
+    def present(self, window, rects=None):
+        self.frames += 1
+    
+    def report(self):
+        return 'present mode: null frames: {}'.format(self.frames)
+
+
+class NullRegistry(dict):
+    """
+    Asset registry for headless runs. Every key gives the same default 
+    asset, e.g. a blank surface, which is enough for game logic.
+    """
+    def __init__(self, default):
+        super().__init__()
+        self.default = default
+    
+    def __missing__(self, key):
+        return self.default
+
+
+class SyntheticKeys:
+    """
+    Stand-in for pg.key.get_pressed() for driving states with scripted 
+    input, e.g. when headless.
+    """
+    def __init__(self, pressed=()):
+        self.pressed = set(pressed)
+    
+    def __getitem__(self, key):
+        return key in self.pressed
+
+
+class DirtyTracker:
+    """
+    Finds the parts of the window that changed since the previous frame for 
+    dirty rect rendering. Everything drawn is marked every frame with a key, 
+    its state (e.g. image) and window rect. Whole window is dirty on the 
+    first frame, after invalidate and when the camera offset changes.
+    """
+    def __init__(self, size=c.WINDOW_SIZE):
+        self.window_rect = pg.Rect((0, 0), size)
+        self.previous = {}
+        self.current = {}
+        self.offset = None
+        self.full = True
+    
+    def invalidate(self):
+        self.full = True
+    
+    def scroll(self, offset):
+        if offset != self.offset:
+            self.offset = offset
+            self.full = True
+    
+    def mark(self, key, state, rect):
+        self.current[key] = (state, tuple(rect))
+    
+    def get_rects(self):
+        """
+        Returns list of rects that changed since the previous call.
+        """
+        previous, current = self.previous, self.current
+        self.previous, self.current = current, {}
+        
+        if self.full:
+            self.full = False
+            return [self.window_rect.copy()]
+        
+        rects = []
+        for key, (state, rect) in current.items():
+            old = previous.get(key)
+            if old is None:
+                rects.append(rect)
+            elif old[0] != state or old[1] != rect:
+                rects.append(old[1])
+                rects.append(rect)
+        for key in previous.keys() - current.keys():
+            rects.append(previous[key][1])
+        
+        return [pg.Rect(rect) for rect in rects]
+
+
+def merge_rects(rects, tw=c.TILE_WIDTH):
+    """
+    Returns tile aligned rects covering the same tiles as rects, with 
+    touching tiles merged to larger rects.
+    """
+    tiles = set()
+    for rect in rects:
+        tiles.update((x, y) 
+                     for y in range(rect.top // tw, (rect.bottom - 1) // tw + 1)
+                     for x in range(rect.left // tw, (rect.right - 1) // tw + 1))
+    
+    return simplify(list(tiles), tw, tw)
+
+
+class OccupancyGrid:
+    """
+    Tile based collision map. Static blockers are baked in once. Sprites 
+    reserve the tiles they stand on and, when they begin moving, the tiles 
+    they are moving to, so every collision check is a tile lookup.
+    Tiles outside the map are blocked.
+    
+    Counters: blockers is the number of blocker rects baked in, checks the 
+    number of tile lookups made by move reservations.
+    """
+    def __init__(self, width, height, tw=c.TILE_WIDTH):
+        self.width = width
+        self.height = height
+        self.tw = tw
+        self.static = bytearray(width * height)
+        self.occupants = {} # Tile: sprite that has reserved it.
+        self.reserved = {} # Sprite: set of tiles it has reserved.
+        self.bumps = [] # (moving sprite, occupant) pairs since last clear.
+        self.blockers = 0
+        self.checks = 0
+        self.moves = 0
+        self.blocked_moves = 0
+    
+    def tiles_of(self, rect):
+        """
+        Returns list of tiles covered by rect.
+        """
+        tw = self.tw
+        return [(x, y) for y in range(rect.top // tw, (rect.bottom - 1) // tw + 1)
+                for x in range(rect.left // tw, (rect.right - 1) // tw + 1)]
+    
+    def add_blocker(self, rect):
+        self.blockers += 1
+        for x, y in self.tiles_of(rect):
+            if 0 <= x < self.width and 0 <= y < self.height:
+                self.static[y * self.width + x] = 1
+    
+    def is_blocked(self, tile):
+        x, y = tile
+        if 0 <= x < self.width and 0 <= y < self.height:
+            return self.static[y * self.width + x] == 1
+        return True
+    
+    def occupant(self, tile):
+        return self.occupants.get(tile)
+    
+    def add(self, sprite):
+        """
+        Registers sprite and reserves the tiles it is on.
+        """
+        sprite.occupancy = self
+        tiles = set(self.tiles_of(sprite.rect))
+        self.reserved[sprite] = tiles
+        for tile in tiles:
+            self.occupants[tile] = sprite
+    
+    def remove(self, sprite):
+        sprite.occupancy = None
+        for tile in self.reserved.pop(sprite, ()):
+            if self.occupants.get(tile) is sprite:
+                del self.occupants[tile]
+    
+    def reserve_move(self, sprite, vector):
+        """
+        Reserves the tiles sprite moves to when moving one tile to vector. 
+        Returns False (and reserves nothing) if any of them is blocked or 
+        reserved by another sprite.
+        """
+        tw = self.tw
+        target = sprite.rect.move(vector[0] * tw, vector[1] * tw)
+        tiles = self.tiles_of(target)
+        self.moves += 1
+        
+        for tile in tiles:
+            self.checks += 1
+            occupant = self.occupants.get(tile)
+            if occupant is not None and occupant is not sprite:
+                self.blocked_moves += 1
+                self.bumps.append((sprite, occupant))
+                return False
+            if self.is_blocked(tile):
+                self.blocked_moves += 1
+                return False
+        
+        reserved = self.reserved.setdefault(sprite, set())
+        for tile in tiles:
+            self.occupants[tile] = sprite
+            reserved.add(tile)
+        return True
+    
+    def finish_move(self, sprite):
+        """
+        Releases the tiles sprite has left.
+        """
+        current = set(self.tiles_of(sprite.rect))
+        for tile in self.reserved.get(sprite, set()) - current:
+            if self.occupants.get(tile) is sprite:
+                del self.occupants[tile]
+        for tile in current:
+            self.occupants[tile] = sprite
+        self.reserved[sprite] = current
+    
+    def stats(self):
+        return {'blockers': self.blockers,
+                'moves': self.moves,
+                'blocked_moves': self.blocked_moves,
+                'checks': self.checks}
+    
+    def report(self):
+        return ('blockers: {blockers} moves: {moves} blocked: {blocked_moves} '
+                'checks: {checks}').format(**self.stats())
+
+
+class SpatialHash:
+    """
+    Uniform grid of buckets for finding drawables that overlap a rect, 
+    e.g. the camera view. Items need a rect and are registered with a draw 
+    layer. Moving items have to call move after their rect has changed.
+    """
+    def __init__(self, bucket_size=c.SPATIAL_BUCKET_SIZE):
+        self.bucket_size = bucket_size
+        self.buckets = {} # (column, row): set of items.
+        self.items = {} # Item: [draw order, bucket range].
+        self.serial = 0
+    
+    def bucket_range(self, rect):
+        bs = self.bucket_size
+        return (rect.left // bs, rect.top // bs, 
+                (rect.right - 1) // bs, (rect.bottom - 1) // bs)
+    
+    def cells(self, bucket_range):
+        left, top, right, bottom = bucket_range
+        return [(x, y) for y in range(top, bottom + 1) 
+                for x in range(left, right + 1)]
+    
+    def add(self, item, layer=0):
+        """
+        Registers item. Items are drawn by layer, then in the order they 
+        were added.
+        """
+        bucket_range = self.bucket_range(item.rect)
+        self.items[item] = [(layer, self.serial), bucket_range]
+        self.serial += 1
+        for cell in self.cells(bucket_range):
+            self.buckets.setdefault(cell, set()).add(item)
+    
+    def remove(self, item):
+        entry = self.items.pop(item, None)
+        if entry is not None:
+            for cell in self.cells(entry[1]):
+                self.buckets[cell].discard(item)
+    
+    def move(self, item):
+        """
+        Moves item to the buckets of its current rect.
+        """
+        entry = self.items.get(item)
+        if entry is None:
+            return
+        
+        bucket_range = self.bucket_range(item.rect)
+        if bucket_range == entry[1]:
+            return
+        
+        for cell in self.cells(entry[1]):
+            self.buckets[cell].discard(item)
+        for cell in self.cells(bucket_range):
+            self.buckets.setdefault(cell, set()).add(item)
+        entry[1] = bucket_range
+    
+    def query(self, rect):
+        """
+        Returns items in the buckets overlapping rect in draw order.
+        """
+        found = set()
+        for cell in self.cells(self.bucket_range(rect)):
+            bucket = self.buckets.get(cell)
+            if bucket:
+                found.update(bucket)
+        
+        items = self.items
+        return sorted(found, key=lambda item: items[item][0])
+
+
+class TriggerIndex:
+    """
+    Maps tiles to the triggers (e.g. portals, items and dialogues) on them, 
+    so that what the player stands on is found with dictionary lookups 
+    instead of testing every trigger. Triggers need a rect and are 
+    registered with a kind, e.g. 'portal'.
+    """
+    def __init__(self, tw=c.TILE_WIDTH):
+        self.tw = tw
+        self.tiles = {} # Tile: list of (kind, trigger).
+        self.lookups = 0
+    
+    def span(self, rect):
+        """
+        Returns first and last column and row of the tiles rect covers.
+        """
+        tw = self.tw
+        return (rect.left // tw, rect.top // tw, 
+                (rect.right - 1) // tw, (rect.bottom - 1) // tw)
+    
+    def tiles_of(self, span):
+        left, top, right, bottom = span
+        return [(x, y) for y in range(top, bottom + 1)
+                for x in range(left, right + 1)]
+    
+    def add(self, kind, trigger):
+        for tile in self.tiles_of(self.span(trigger.rect)):
+            self.tiles.setdefault(tile, []).append((kind, trigger))
+    
+    def remove(self, trigger):
+        for tile in self.tiles_of(self.span(trigger.rect)):
+            entries = self.tiles.get(tile, [])
+            entries[:] = [entry for entry in entries if entry[1] is not trigger]
+            if not entries:
+                self.tiles.pop(tile, None)
+    
+    def query(self, span):
+        """
+        Returns dictionary of kind: list of triggers on the tiles of span 
+        (see span), in the order they were added.
+        """
+        found = {}
+        for tile in self.tiles_of(span):
+            self.lookups += 1
+            for kind, trigger in self.tiles.get(tile, ()):
+                triggers = found.setdefault(kind, [])
+                if trigger not in triggers:
+                    triggers.append(trigger)
+        return found
+
+
 class Portal:
     """
     Used for storing the transportation points between maps.
@@ -211,7 +911,36 @@ class Dialogue:
         self.dict = properties
         
 
+class EventBus:
+    """
+    Delivers gameplay events to the handlers subscribed to their type. 
+    Events are emitted with keyword data that is passed to the handlers, 
+    e.g. emit('chicken_caught', name='red_move', tiled_id=12).
+    
+    Event types emitted by MapState: map_entered, item_found, 
+    chicken_caught and dialogue_closed.
+    """
+    def __init__(self):
+        self.handlers = {} # Event type: list of handlers.
+    
+    def subscribe(self, event_type, handler):
+        self.handlers.setdefault(event_type, []).append(handler)
+    
+    def unsubscribe(self, event_type, handler):
+        handlers = self.handlers.get(event_type, [])
+        if handler in handlers:
+            handlers.remove(handler)
+    
+    def emit(self, event_type, **data):
+        for handler in tuple(self.handlers.get(event_type, ())):
+            handler(**data)
+
+
 class Quest:
+    # Event type: name of the method handling it. Quest logic runs only 
+    # when these events are emitted.
+    subscriptions = {}
+    
     def __init__(self):
         self.active = True
         self.completed = False
@@ -221,14 +950,17 @@ class Quest:
         self.game_data = game_data
         pass
     
-    def update(self):
-        pass
+    def subscribe(self, events):
+        for event_type, method_name in self.subscriptions.items():
+            events.subscribe(event_type, getattr(self, method_name))
     
     def deactivate(self):
         pass
 
 
 class ChickenRescue(Quest):
+    subscriptions = {'chicken_caught': 'count_chickens'}
+    
     def __init__(self):
         super().__init__()
         self.name = 'chicken_rescue'
@@ -242,7 +974,7 @@ class ChickenRescue(Quest):
             game_data['player_data']['chickens']['rescue'] = True
         self.game_data = game_data
         
-    def update(self):
+    def count_chickens(self, **event):
         if not self.completed:
             if (self.game_data['player_data']['chickens']['amount'] == 
             self.chickens_to_rescue):
@@ -260,6 +992,8 @@ class ChickenRescue(Quest):
 
 
 class ChickenCatch(Quest):
+    subscriptions = {'chicken_caught': 'count_chickens'}
+    
     def __init__(self):
         super().__init__()
         self.name = 'chicken_catch'
@@ -273,7 +1007,7 @@ class ChickenCatch(Quest):
             game_data['player_data']['chickens']['catch'] = True
         self.game_data = game_data
     
-    def update(self):
+    def count_chickens(self, **event):
         if not self.completed:
             if (self.game_data['player_data']['chickens']['amount'] == 
             self.chickens_to_catch):